@@ -0,0 +1 @@
+default_app_config = "fctools_salary.apps.FctoolsSalaryConfig"
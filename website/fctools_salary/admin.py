@@ -6,24 +6,67 @@
 # Proprietary and confidential
 # Author: German Yakimov <german13yakimov@gmail.com>
 
-from datetime import datetime, timedelta
-
 from django import forms
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
 from django.core.exceptions import ValidationError
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import reverse
+from django.utils.html import format_html
 
+from fctools_salary.domains.accounts.calculation_job import CalculationJob
 from fctools_salary.domains.accounts.percent_dependency import PercentDependency
 from fctools_salary.domains.accounts.report import Report
 from fctools_salary.domains.accounts.test import Test
 from fctools_salary.domains.accounts.user import User
 from fctools_salary.domains.tracker.campaign import Campaign
+from fctools_salary.domains.tracker.campaign_daily_stat import CampaignDailyStat
 from fctools_salary.domains.tracker.geo import Geo
 from fctools_salary.domains.tracker.offer import Offer
 from fctools_salary.domains.tracker.traffic_source import TrafficSource
 from fctools_salary.filters import ActiveUsersFilter
+from fctools_salary.forms import PayrollForm
+from fctools_salary.services.engine.calculation_jobs import enqueue_payroll
+from fctools_salary.services.engine.tests_manager import TestsManager
 from fctools_salary.services.helpers.test_splitter import TestSplitter
 
 
+def calculate_salary(modeladmin, request, queryset):
+    users = list(queryset.filter(salary_group__gt=0))
+
+    if not users:
+        modeladmin.message_user(request, "There are no active users among selected.", level=messages.WARNING)
+        return None
+
+    if "apply" in request.POST:
+        form = PayrollForm(request.POST)
+
+        if form.is_valid():
+            # users are calculated by one payroll job in background worker (as calculations from /count),
+            # progress and results are shown by its status page
+            job = enqueue_payroll(users, form.cleaned_data["start_date"], form.cleaned_data["end_date"],
+                                  form.cleaned_data["update_db"], form.cleaned_data["traffic_groups"])
+
+            modeladmin.message_user(request, f"Payroll calculation is started for {len(users)} users.")
+
+            return redirect("count_status", job_id=job.id)
+    else:
+        form = PayrollForm()
+
+    return TemplateResponse(request, "admin/fctools_salary/user/calculate_salary.html", {
+        **modeladmin.admin_site.each_context(request),
+        "title": "Calculate salary",
+        "opts": modeladmin.model._meta,
+        "form": form,
+        "users": users,
+        "action_checkbox_name": ACTION_CHECKBOX_NAME,
+    })
+
+
+calculate_salary.short_description = "Calculate salary for selected users"
+
+
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
     list_display = [
@@ -48,6 +91,8 @@ class UserAdmin(admin.ModelAdmin):
         "id",
     ]
 
+    actions = [calculate_salary, ]
+
 
 @admin.register(Offer)
 class OfferAdmin(admin.ModelAdmin):
@@ -187,22 +232,14 @@ class TestForm(forms.ModelForm):
 
 
 def split_tests(modeladmin, request, queryset):
-    splitter = TestSplitter()
-
-    for test in queryset:
-        splitter.split(test)
+    TestSplitter().split_all(queryset.prefetch_related("offers", "traffic_sources", "geo"))
 
 
 split_tests.short_description = "Split selected tests"
 
 
 def archive_expired_tests(modeladmin, request, queryset):
-    today = datetime.utcnow().date()
-
-    for test in queryset:
-        if today - test.adding_date >= timedelta(days=test.lifetime):
-            test.archived = True
-            test.save()
+    TestsManager.archive_expired_tests(queryset)
 
 
 archive_expired_tests.short_description = "Archive expired tests"
@@ -336,4 +373,70 @@ class ReportAdmin(admin.ModelAdmin):
         "profit_inapp",
         "profit_fpa_hsa_pwa",
         "profit_tik_tok",
+        "settled",
+    ]
+
+
+@admin.register(CalculationJob)
+class CalculationJobAdmin(admin.ModelAdmin):
+    list_display = [
+        "user",
+        "start_date",
+        "end_date",
+        "commit",
+        "status",
+        "status_page",
+        "created_at",
+        "finished_at",
+    ]
+
+    list_filter = [
+        "status",
+    ]
+
+    list_select_related = [
+        "user",
+    ]
+
+    readonly_fields = [
+        "users",
+        "status",
+        "result",
+        "error",
+        "traceback",
+        "created_at",
+        "started_at",
+        "finished_at",
+        "heartbeat_at",
+    ]
+
+    def status_page(self, job):
+        return format_html('<a href="{}">{}</a>', reverse("count_status", kwargs={"job_id": job.id}),
+                           "Result" if job.finished else "Progress")
+
+    status_page.short_description = "Status page"
+
+
+@admin.register(CampaignDailyStat)
+class CampaignDailyStatAdmin(admin.ModelAdmin):
+    list_display = [
+        "campaign_id",
+        "name",
+        "user",
+        "traffic_group",
+        "day",
+        "revenue",
+        "cost",
+        "profit",
+        "clicks",
+        "main_geo",
+    ]
+
+    list_filter = [
+        "traffic_group",
+        "day",
+    ]
+
+    list_select_related = [
+        "user",
     ]
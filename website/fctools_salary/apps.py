@@ -13,3 +13,6 @@ class FctoolsSalaryConfig(AppConfig):
     name = 'fctools_salary'
     verbose_name = 'FCTools salary'
     label = 'fctools_salary'
+
+    def ready(self):
+        from fctools_salary import signals  # noqa: F401
@@ -0,0 +1,81 @@
+# Copyright © 2020-2021 Filthy Claws Tools - All Rights Reserved
+#
+# This file is part of FCTools_payroll
+#
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Author: German Yakimov <german13yakimov@gmail.com>
+
+import uuid
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+
+
+class CalculationJob(models.Model):
+    """
+    This model represents salary calculation, that was requested from /count page and runs in background,
+    or payroll run for several users, that was requested from admin (job without user, calculated users are
+    in users field).
+    Job is created with status "queued", worker claims it (status "running") and saves calculation result
+    (status "done") or error message (status "failed").
+    Process, that runs job, updates its heartbeat time, so job of stopped process is found and marked as failed.
+    """
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    STATUSES = (
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False, )
+
+    user = models.ForeignKey(to="User", verbose_name="User", null=True, blank=True, on_delete=models.CASCADE, )
+
+    users = models.ManyToManyField(to="User", verbose_name="Payroll users", blank=True,
+                                   related_name="payroll_jobs", )
+
+    start_date = models.DateField(verbose_name="Start date", null=False, blank=False, )
+
+    end_date = models.DateField(verbose_name="End date", null=False, blank=False, )
+
+    commit = models.BooleanField(verbose_name="Commit", default=False, )
+
+    traffic_groups = models.JSONField(verbose_name="Traffic groups", default=list, )
+
+    status = models.CharField(verbose_name="Status", max_length=16, choices=STATUSES, default=QUEUED, )
+
+    result = models.JSONField(verbose_name="Result", null=True, blank=True, default=None, encoder=DjangoJSONEncoder, )
+
+    error = models.TextField(verbose_name="Error", null=True, blank=True, default=None, )
+
+    traceback = models.TextField(verbose_name="Traceback", null=True, blank=True, default=None, )
+
+    created_at = models.DateTimeField(verbose_name="Created at", auto_now_add=True, )
+
+    started_at = models.DateTimeField(verbose_name="Started at", null=True, blank=True, default=None, )
+
+    finished_at = models.DateTimeField(verbose_name="Finished at", null=True, blank=True, default=None, )
+
+    heartbeat_at = models.DateTimeField(verbose_name="Heartbeat at", null=True, blank=True, default=None, )
+
+    class Meta:
+        verbose_name = "Calculation job"
+        verbose_name_plural = "Calculation jobs"
+
+    @property
+    def finished(self):
+        return self.status in (self.DONE, self.FAILED)
+
+    @property
+    def is_payroll(self):
+        return self.user_id is None
+
+    def __str__(self):
+        return f"{self.user or 'Payroll'} {self.start_date} - {self.end_date} ({self.status})"
@@ -40,3 +40,13 @@ class Report(models.Model):
 
     profit_tik_tok = models.DecimalField(verbose_name="Tik Tok profit", null=True, decimal_places=6, max_digits=13,
                                          default=None, )
+
+    """
+    Number of delta checks in a row, that didn't find any profit changes for this period.
+    When it reaches settings.DELTAS_SETTLE_CHECKS, period is considered as settled (closed for changes)
+    and it's skipped by delta calculations.
+    """
+    unchanged_checks = models.PositiveSmallIntegerField(verbose_name="Unchanged checks", null=False, blank=False,
+                                                        default=0, )
+
+    settled = models.BooleanField(verbose_name="Settled", null=False, blank=False, default=False, )
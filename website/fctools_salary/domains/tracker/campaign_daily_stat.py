@@ -0,0 +1,59 @@
+# Copyright © 2020-2021 Filthy Claws Tools - All Rights Reserved
+#
+# This file is part of FCTools_payroll
+#
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Author: German Yakimov <german13yakimov@gmail.com>
+
+from django.conf import settings
+from django.db import models
+
+
+class CampaignDailyStat(models.Model):
+    """
+    This model represents campaign statistics from tracker for one day (local copy of tracker statistics).
+    Rows are filled by update_daily_stats(), statistics for any period is sum of its days.
+    Campaign may be not saved to database yet (it's saved only with committed calculation),
+    so campaign and traffic source are stored without foreign key constraints.
+    """
+
+    campaign = models.ForeignKey(
+        "Campaign", verbose_name="Campaign", on_delete=models.DO_NOTHING, db_constraint=False,
+        related_name="daily_stats",
+    )
+
+    user = models.ForeignKey("User", verbose_name="User", on_delete=models.CASCADE, null=False, blank=False, )
+
+    name = models.CharField(max_length=256, verbose_name="Name", null=True, blank=True, )
+
+    traffic_group = models.CharField(
+        max_length=16,
+        verbose_name="Traffic group",
+        null=False,
+        blank=False,
+        choices=settings.TRAFFIC_GROUPS,
+    )
+
+    traffic_source_id = models.IntegerField(verbose_name="Traffic source ID", null=False, blank=False, )
+
+    day = models.DateField(verbose_name="Day", null=False, blank=False, )
+
+    revenue = models.DecimalField(verbose_name="Revenue", null=False, blank=False, decimal_places=6, max_digits=12, )
+
+    cost = models.DecimalField(verbose_name="Cost", null=False, blank=False, decimal_places=6, max_digits=12, )
+
+    profit = models.DecimalField(verbose_name="Profit", null=False, blank=False, decimal_places=6, max_digits=12, )
+
+    clicks = models.PositiveIntegerField(verbose_name="Clicks", null=False, blank=False, default=0, )
+
+    main_geo = models.CharField(max_length=128, verbose_name="Main geo", null=True, blank=True, default=None, )
+
+    class Meta:
+        verbose_name = "Campaign daily statistics"
+        verbose_name_plural = verbose_name
+        unique_together = [("campaign", "day")]
+        indexes = [models.Index(fields=["user", "day"])]
+
+    def __str__(self):
+        return f"{self.campaign_id} {self.day}"
@@ -41,3 +41,31 @@ class CalculationForm(forms.Form):
 
     def clean(self):
         return self.cleaned_data
+
+
+class PayrollForm(forms.Form):
+    """
+    This form created for batch payroll run configuration in admin interface. Here you can select period
+    and other parameters.
+    """
+
+    start_date = forms.DateField(required=True, widget=forms.DateInput(attrs={"type": "date"}))
+
+    end_date = forms.DateField(required=True, widget=forms.DateInput(attrs={"type": "date"}))
+
+    update_db = forms.BooleanField(initial=False, required=False)
+
+    traffic_groups = forms.MultipleChoiceField(
+        choices=settings.TRAFFIC_GROUPS,
+        widget=forms.CheckboxSelectMultiple,
+        required=True,
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+
+        if "start_date" in cleaned_data and "end_date" in cleaned_data and \
+                cleaned_data["start_date"] > cleaned_data["end_date"]:
+            raise forms.ValidationError("Start date can't be greater than end date.")
+
+        return cleaned_data
@@ -0,0 +1,59 @@
+# Copyright © 2020-2021 Filthy Claws Tools - All Rights Reserved
+#
+# This file is part of FCTools_payroll
+#
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Author: German Yakimov <german13yakimov@gmail.com>
+
+from datetime import date
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from fctools_salary.domains.accounts.user import User
+from fctools_salary.services.engine.payroll import calculate_payroll
+
+
+class Command(BaseCommand):
+    help = "Calculate salary for all active users for the period (batch payroll run)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("start_date", type=date.fromisoformat, help="Period start date (YYYY-MM-DD).")
+        parser.add_argument("end_date", type=date.fromisoformat, help="Period end date (YYYY-MM-DD).")
+        parser.add_argument("--commit", action="store_true", help="Save results to database.")
+        parser.add_argument(
+            "--traffic-groups",
+            nargs="+",
+            default=[traffic_group for traffic_group, _ in settings.TRAFFIC_GROUPS],
+            choices=[traffic_group for traffic_group, _ in settings.TRAFFIC_GROUPS],
+            help="Traffic groups to calculate (all by default).",
+        )
+        parser.add_argument("--users", nargs="+", type=int, help="Ids of users to calculate (all active by default).")
+        parser.add_argument("--workers", type=int, help="Number of worker processes (settings.PAYROLL_WORKERS "
+                                                        "by default).")
+
+    def handle(self, *args, **options):
+        if options["start_date"] > options["end_date"]:
+            raise CommandError("Start date can't be greater than end date.")
+
+        users = None
+
+        if options["users"]:
+            users = list(User.objects.filter(id__in=options["users"], salary_group__gt=0))
+
+        results = calculate_payroll(options["start_date"], options["end_date"], options["commit"],
+                                    options["traffic_groups"], users, options["workers"])
+
+        for user_result in results.values():
+            if user_result["error"]:
+                self.stderr.write(self.style.ERROR(f"{user_result['user']}: {user_result['error']}"))
+            else:
+                result = user_result["result"]
+                summary = ", ".join(f"{traffic_group}: {result['result'][traffic_group][1]}"
+                                    for traffic_group in result["result"])
+
+                self.stdout.write(f"{user_result['user']}: {summary}. Report: {result['report_name']}")
+
+        failed = sum(1 for user_result in results.values() if user_result["error"])
+        self.stdout.write(self.style.SUCCESS(f"Calculated {len(results) - failed} users, failed {failed}."))
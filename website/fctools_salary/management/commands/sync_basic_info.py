@@ -0,0 +1,42 @@
+# Copyright © 2020-2021 Filthy Claws Tools - All Rights Reserved
+#
+# This file is part of FCTools_payroll
+#
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Author: German Yakimov <german13yakimov@gmail.com>
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from fctools_salary.services.binom.sync_scheduler import sync_basic_info
+
+
+class Command(BaseCommand):
+    help = "Sync users, offers and traffic sources with tracker, if they are stale (once or periodically)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--force", action="store_true", help="Sync even if info is fresh.")
+        parser.add_argument("--loop", action="store_true", help="Sync periodically until the process is stopped.")
+        parser.add_argument("--interval", type=int, default=settings.BASIC_INFO_SYNC_INTERVAL,
+                            help="Interval of periodic syncing in seconds (settings.BASIC_INFO_SYNC_INTERVAL "
+                                 "by default).")
+
+    def handle(self, *args, **options):
+        if options["interval"] <= 0:
+            raise CommandError("Interval must be positive.")
+
+        while True:
+            counts = sync_basic_info(force=options["force"])
+
+            if counts is None:
+                self.stdout.write("Info is fresh or is being synced by other process, syncing is skipped.")
+            else:
+                self.stdout.write(self.style.SUCCESS(f"Syncing was successful: {counts}."))
+
+            if not options["loop"]:
+                break
+
+            time.sleep(options["interval"])
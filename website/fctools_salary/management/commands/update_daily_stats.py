@@ -0,0 +1,49 @@
+# Copyright © 2020-2021 Filthy Claws Tools - All Rights Reserved
+#
+# This file is part of FCTools_payroll
+#
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Author: German Yakimov <german13yakimov@gmail.com>
+
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from fctools_salary.domains.accounts.user import User
+from fctools_salary.services.binom.update import sync_daily_stats, update_daily_stats
+
+
+class Command(BaseCommand):
+    help = "Update local daily campaigns statistics from tracker (incrementally or for the period)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", nargs="+", type=int, help="Ids of users to update (all active by default).")
+        parser.add_argument("--start-date", type=date.fromisoformat, help="First day to update (YYYY-MM-DD).")
+        parser.add_argument("--end-date", type=date.fromisoformat, help="Last day to update (YYYY-MM-DD).")
+        parser.add_argument("--main-geo", action="store_true", help="Get main geo of campaigns for each day.")
+
+    def handle(self, *args, **options):
+        users = None
+
+        if options["users"]:
+            users = list(User.objects.filter(id__in=options["users"]))
+
+        if options["start_date"] or options["end_date"]:
+            if not (options["start_date"] and options["end_date"]):
+                raise CommandError("Both start date and end date are required for the period.")
+
+            if options["start_date"] > options["end_date"]:
+                raise CommandError("Start date can't be greater than end date.")
+
+            if users is None:
+                users = list(User.objects.filter(salary_group__gt=0))
+
+            result = {user.id: update_daily_stats(user, options["start_date"], options["end_date"],
+                                                  options["main_geo"])
+                      for user in users}
+        else:
+            result = sync_daily_stats(users, options["main_geo"])
+
+        self.stdout.write(self.style.SUCCESS(f"Daily statistics were updated for {len(result)} users, "
+                                             f"rows: {sum(result.values())}."))
@@ -8,9 +8,7 @@
 
 import logging
 
-from django.urls import reverse
-
-from fctools_salary.services.binom.update import update_basic_info
+from fctools_salary.services.binom.sync_scheduler import request_basic_info_sync
 from fctools_salary.views import error_response
 
 _logger = logging.getLogger(__name__)
@@ -19,9 +17,10 @@ _logger = logging.getLogger(__name__)
 class UpdateDatabaseMiddleware:
     """
     Middleware for database updating.
-    If request's path is "/admin/fctools_salary" (user is going to edit salary database)
-    or "/count" (user is going to calculate something), this middleware updates database
-    (gets current information from tracker).
+    If request's path is "/admin/fctools_salary" (user is going to edit salary database) and info from tracker
+    is stale (see settings.BASIC_INFO_MAX_AGE), this middleware starts database updating in background,
+    so page doesn't wait for tracker ("?sync=force" starts updating even if info is fresh).
+    Calculations from "/count" update database in background job.
     """
 
     def __init__(self, get_response):
@@ -29,9 +28,8 @@ class UpdateDatabaseMiddleware:
 
     def __call__(self, request):
         try:
-            if (request.method == 'GET' and request.path == '/admin/fctools_salary/') or \
-                    (request.method == 'POST' and request.path == reverse('count')):
-                update_basic_info()
+            if request.method == 'GET' and request.path == '/admin/fctools_salary/':
+                request_basic_info_sync(force=request.GET.get('sync') == 'force')
         except Exception as exception:
             _logger.error(str(exception))
             return error_response(request, exception)
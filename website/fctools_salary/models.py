@@ -6,11 +6,13 @@
 # Proprietary and confidential
 # Author: German Yakimov <german13yakimov@gmail.com>
 
+from fctools_salary.domains.accounts.calculation_job import CalculationJob
 from fctools_salary.domains.accounts.percent_dependency import PercentDependency
 from fctools_salary.domains.accounts.report import Report
 from fctools_salary.domains.accounts.test import Test
 from fctools_salary.domains.accounts.user import User
 from fctools_salary.domains.tracker.campaign import Campaign
+from fctools_salary.domains.tracker.campaign_daily_stat import CampaignDailyStat
 from fctools_salary.domains.tracker.geo import Geo
 from fctools_salary.domains.tracker.offer import Offer
 from fctools_salary.domains.tracker.traffic_source import TrafficSource
@@ -0,0 +1,234 @@
+# Copyright © 2020-2021 Filthy Claws Tools - All Rights Reserved
+#
+# This file is part of FCTools_payroll
+#
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Author: German Yakimov <german13yakimov@gmail.com>
+
+import asyncio
+import functools
+import logging
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from fctools_salary.domains.accounts.user import User
+from fctools_salary.exceptions import UpdateError
+from fctools_salary.services.binom import get_info
+from fctools_salary.services.helpers.local_stats import get_local_campaigns
+
+_logger = logging.getLogger(__name__)
+
+# semaphore is bound to event loop, so each loop (e.g. each async_to_sync call) has its own one
+_tracker_semaphores = weakref.WeakKeyDictionary()
+
+
+def _get_tracker_semaphore():
+    """
+    Get semaphore, which limits number of concurrent tracker calls of running event loop
+    (settings.BINOM_CONCURRENCY).
+
+    :return: semaphore of running event loop
+    :rtype: asyncio.Semaphore
+    """
+
+    loop = asyncio.get_running_loop()
+    semaphore = _tracker_semaphores.get(loop)
+
+    if semaphore is None:
+        semaphore = _tracker_semaphores[loop] = asyncio.Semaphore(settings.BINOM_CONCURRENCY)
+
+    return semaphore
+
+
+def _run_in_thread(function):
+    """
+    Make coroutine function (asyncio variant) from blocking tracker function. Function runs in worker thread,
+    so independent fetches can be awaited concurrently on one event loop, number of concurrent calls is limited
+    by settings.BINOM_CONCURRENCY. Function mustn't query database: worker thread connection would be out of
+    caller's transaction.
+
+    :param function: function to wrap
+    :return: coroutine function
+    """
+
+    function_in_thread = sync_to_async(function, thread_sensitive=False)
+
+    @functools.wraps(function)
+    async def wrapper(*args, **kwargs):
+        async with _get_tracker_semaphore():
+            return await function_in_thread(*args, **kwargs)
+
+    return wrapper
+
+
+def _run_in_caller_thread(function):
+    """
+    Make coroutine function from blocking database function. Function runs in thread of async_to_sync caller,
+    so its queries use caller's connection (and transaction).
+
+    :param function: function to wrap
+    :return: coroutine function
+    """
+
+    return sync_to_async(function, thread_sensitive=True)
+
+
+get_users = _run_in_thread(get_info.get_users)
+get_offers = _run_in_thread(get_info.get_offers)
+get_offers_ids_by_campaign = _run_in_thread(get_info.get_offers_ids_by_campaign)
+get_campaign_main_geo = _run_in_thread(get_info.get_campaign_main_geo)
+get_campaigns_main_geos = _run_in_thread(get_info.get_campaigns_main_geos)
+
+_fetch_campaigns = _run_in_thread(get_info.fetch_campaigns)
+_attach_campaigns_offers = _run_in_thread(get_info.attach_campaigns_offers)
+_get_traffic_sources = _run_in_thread(get_info.get_traffic_sources)
+
+_get_local_campaigns = _run_in_caller_thread(get_local_campaigns)
+_get_campaigns_db_offers = _run_in_caller_thread(get_info.get_campaigns_db_offers)
+_get_all_users = _run_in_caller_thread(lambda: list(User.objects.all()))
+
+
+async def get_traffic_sources(users=None, max_workers=None):
+    """
+    Get traffic sources of users from tracker (asyncio variant of get_info.get_traffic_sources).
+    Users are taken from database on caller's thread, if they aren't passed.
+
+    :param users: users, which traffic sources are requested (all users by default)
+    :type users: Optional[List[User]]
+
+    :param max_workers: max number of parallel requests
+    :type max_workers: int
+
+    :return: see get_info.get_traffic_sources
+    """
+
+    if users is None:
+        users = await _get_all_users()
+
+    return await _get_traffic_sources(users, max_workers)
+
+
+async def get_campaigns(start_date, end_date, user, redis_server=None, max_workers=None, with_offers=True,
+                        raise_on_error=False):
+    """
+    Get user campaigns from start_date to end_date (asyncio variant of get_info.get_campaigns).
+    Database is read on caller's thread, only tracker and Redis requests are made in worker threads.
+
+    :param start_date: period start date
+    :type start_date: date
+
+    :param end_date: period end date
+    :type end_date: date
+
+    :param user: user
+    :type user: User
+
+    :param redis_server: RedisClient instance for caching
+    :type redis_server: RedisClient
+
+    :param max_workers: max number of parallel requests for campaigns routing
+    :type max_workers: int
+
+    :param with_offers: get campaigns routing (offers ids)
+    :type with_offers: bool
+
+    :param raise_on_error: raise UpdateError, if campaigns can't be get (else empty list is returned)
+    :type raise_on_error: bool
+
+    :return: list of campaigns from tracker with offers ids (ordered by id)
+    :rtype: List[CampaignRecord]
+    """
+
+    _logger.info(f"Start getting campaigns from {start_date} to {end_date} for user {user}")
+
+    result = None
+
+    if settings.CAMPAIGNS_SOURCE == "local":
+        result = await _get_local_campaigns(start_date, end_date, user)
+
+        if result is None:
+            _logger.warning(f"Local statistics doesn't cover period from {start_date} to {end_date} for user {user}, "
+                            f"campaigns are taken from tracker.")
+
+    if result is None:
+        result = await _fetch_campaigns(start_date, end_date, user)
+
+    if result is None:
+        if raise_on_error:
+            raise UpdateError(message=f"Can't get campaigns from {start_date} to {end_date} for user {user}")
+
+        return []
+
+    if not with_offers:
+        _logger.info(f"Campaigns for {user} from {start_date} to {end_date} were successfully get (without routing).")
+        return result
+
+    campaigns_db_offers = await _get_campaigns_db_offers(user)
+    await _attach_campaigns_offers(result, campaigns_db_offers, redis_server, max_workers)
+
+    _logger.info(f"Campaigns for {user} from {start_date} to {end_date} were successfully get.")
+    return result
+
+
+async def get_campaigns_for_periods(periods, user, redis_server=None, with_offers=True, raise_on_error=False):
+    """
+    Get user campaigns for several periods concurrently (number of concurrent tracker calls is limited by
+    settings.BINOM_CONCURRENCY).
+
+    :param periods: list of (start date, end date) pairs
+    :type periods: List[Tuple[date, date]]
+
+    :param user: user
+    :type user: User
+
+    :param redis_server: RedisClient instance for caching
+    :type redis_server: RedisClient
+
+    :param with_offers: get campaigns routing (offers ids)
+    :type with_offers: bool
+
+    :param raise_on_error: raise UpdateError, if campaigns for some period can't be get (else they are empty)
+    :type raise_on_error: bool
+
+    :return: list of campaigns from tracker for each period (in periods order)
+    :rtype: List[List[CampaignTracker]]
+    """
+
+    return list(
+        await asyncio.gather(
+            *[get_campaigns(start_date, end_date, user, redis_server, with_offers=with_offers,
+                            raise_on_error=raise_on_error)
+              for start_date, end_date in periods]
+        )
+    )
+
+
+async def get_campaigns_for_users(start_date, end_date, users, redis_server=None):
+    """
+    Get campaigns from start_date to end_date for several users concurrently (number of concurrent tracker calls
+    is limited by settings.BINOM_CONCURRENCY).
+
+    :param start_date: period start date
+    :type start_date: date
+
+    :param end_date: period end date
+    :type end_date: date
+
+    :param users: users
+    :type users: List[User]
+
+    :param redis_server: RedisClient instance for caching
+    :type redis_server: RedisClient
+
+    :return: list of campaigns from tracker for each user id
+    :rtype: Dict[int, List[CampaignTracker]]
+    """
+
+    campaigns_lists = await asyncio.gather(
+        *[get_campaigns(start_date, end_date, user, redis_server) for user in users]
+    )
+
+    return {user.id: campaigns_list for user, campaigns_list in zip(users, campaigns_lists)}
@@ -0,0 +1,120 @@
+# Copyright © 2020-2021 Filthy Claws Tools - All Rights Reserved
+#
+# This file is part of FCTools_payroll
+#
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Author: German Yakimov <german13yakimov@gmail.com>
+
+import logging
+import os
+import threading
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from fctools_salary.services.helpers import requests_manager
+
+_logger = logging.getLogger(__name__)
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+class _BoundedRetry(Retry):
+    """
+    Retry policy with exponential backoff limited by settings.BINOM_BACKOFF_MAX seconds.
+    """
+
+    def get_backoff_time(self):
+        return min(super().get_backoff_time(), settings.BINOM_BACKOFF_MAX)
+
+
+class BinomClient:
+    """
+    HTTP client for tracker API. Keeps one session with connection pool, so all requests to tracker
+    reuse already opened (keep-alive) connections instead of new TLS handshake for each request.
+    """
+
+    def __init__(self):
+        retry = _BoundedRetry(
+            total=settings.BINOM_MAX_RETRIES,
+            connect=settings.BINOM_MAX_RETRIES,
+            read=settings.BINOM_MAX_RETRIES,
+            status=settings.BINOM_MAX_RETRIES,
+            backoff_factor=settings.BINOM_BACKOFF_FACTOR,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(["GET"]),
+            raise_on_status=False,
+        )
+
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=settings.BINOM_POOL_SIZE,
+            max_retries=retry,
+            pool_block=True,
+        )
+
+        self._session = requests.Session()
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+
+    @staticmethod
+    def timeout(endpoint):
+        """
+        Get (connect timeout, read timeout) pair for tracker endpoint.
+
+        :param endpoint: endpoint name (tracker page or arm.php action)
+        :type endpoint: str
+
+        :return: connect and read timeouts in seconds
+        :rtype: Tuple[float, float]
+        """
+
+        return settings.BINOM_TIMEOUTS.get(endpoint, settings.BINOM_TIMEOUTS["default"])
+
+    def get(self, endpoint, url, params=None):
+        """
+        Make GET-request to tracker with endpoint timeouts and retry policy.
+
+        :param endpoint: endpoint name (tracker page or arm.php action)
+        :type endpoint: str
+
+        :param url: request url
+        :type url: str
+
+        :param params: query params
+        :type params: Dict[str, Any]
+
+        :return: response if success, else exception
+        :rtype: Union[requests.Response, Exception]
+        """
+
+        return requests_manager.get(self._session, url, params=params, timeout=self.timeout(endpoint))
+
+    def close(self):
+        self._session.close()
+
+
+def get_client():
+    """
+    Get process-wide tracker client. Client is created again after fork (e.g. in uWSGI workers),
+    because connections from the pool can't be shared between processes.
+
+    :return: tracker client
+    :rtype: BinomClient
+    """
+
+    global _client, _client_pid
+
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            _logger.info(f"Create tracker client for process {os.getpid()}")
+
+            _client = BinomClient()
+            _client_pid = os.getpid()
+
+    return _client
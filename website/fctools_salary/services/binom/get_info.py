@@ -8,7 +8,8 @@
 
 import json
 import logging
-from copy import deepcopy
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import date
 from decimal import Decimal
 from typing import List, Dict
@@ -21,10 +22,19 @@ from fctools_salary.domains.accounts.user import User
 from fctools_salary.domains.tracker.campaign import Campaign
 from fctools_salary.domains.tracker.offer import Offer
 from fctools_salary.domains.tracker.traffic_source import TrafficSource
-from fctools_salary.services.helpers import requests_manager
+from fctools_salary.exceptions import UpdateError
+from fctools_salary.services.binom.client import get_client
+from fctools_salary.services.helpers.campaign_batch import CampaignBatch, CampaignList
+from fctools_salary.services.helpers.campaign_record import CampaignRecord
+from fctools_salary.services.helpers.local_stats import get_local_campaigns
 
 _logger = logging.getLogger(__name__)
 
+# request key -> Future with result, for tracker requests that are in progress right now
+# (routing: ("routing", campaign id), main geo: ("main_geo", campaign id, start date, end date))
+_shared_requests = {}
+_shared_requests_lock = threading.Lock()
+
 
 def get_users():
     """
@@ -36,8 +46,8 @@ def get_users():
 
     _logger.info("Start getting users from tracker...")
 
-    response = requests_manager.get(
-        requests.Session(), settings.TRACKER_URL, params={"page": "Users", "api_key": settings.BINOM_API_KEY}
+    response = get_client().get(
+        "Users", settings.TRACKER_URL, params={"page": "Users", "api_key": settings.BINOM_API_KEY}
     )
 
     if not isinstance(response, requests.Response):
@@ -72,8 +82,8 @@ def get_offers():
 
     _logger.info("Start getting offers from tracker...")
 
-    response = requests_manager.get(
-        requests.Session(),
+    response = get_client().get(
+        "Offers",
         settings.TRACKER_URL,
         params={"page": "Offers", "api_key": settings.BINOM_API_KEY, "group": "all", "status": "all"},
     )
@@ -109,83 +119,130 @@ def get_offers():
         return []
 
 
-def get_traffic_sources():
+def _fetch_user_traffic_sources(user):
+    """
+    Get traffic sources, that are visible for user in tracker.
+
+    :param user: user
+    :type user: User
+
+    :return: traffic sources json, exception for network or decoding error
+    :rtype: Union[List[Dict[str, Any]], Exception]
+    """
+
+    response = get_client().get(
+        "Traffic_Sources",
+        settings.TRACKER_URL,
+        params={
+            "page": "Traffic_Sources",
+            "api_key": settings.BINOM_API_KEY,
+            "user_group": user.id,
+            "status": "all",
+        },
+    )
+
+    if not isinstance(response, requests.Response):
+        return response
+
+    try:
+        return response.json()
+    except json.JSONDecodeError as decode_error:
+        return decode_error
+
+
+def get_traffic_sources(users=None, max_workers=None):
     """
-    Get traffic sources from tracker.
+    Get traffic sources from tracker. Traffic sources of users are requested in parallel,
+    user owns traffic sources, that are visible for him, unless he sees all traffic sources (admin).
+    If traffic sources of some users can't be get, traffic sources of other users are returned
+    with ids of these users (so result is incomplete).
+
+    :param users: owners of traffic sources, all users by default
+    :type users: List[User]
 
-    :return: list of traffic sources
-    :rtype: List[TrafficSource]
+    :param max_workers: max number of parallel requests
+    :type max_workers: int
+
+    :return: list of traffic sources (empty, if they can't be get) and ids of users, whose traffic sources can't be get
+    :rtype: Tuple[List[TrafficSource], Set[int]]
     """
 
-    session = requests.Session()
+    client = get_client()
     result = []
+    failed_users_ids = set()
 
     _logger.info("Start getting traffic sources from tracker...")
 
-    all_traffic_sources = requests_manager.get(
-        session,
+    all_traffic_sources = client.get(
+        "Traffic_Sources",
         settings.TRACKER_URL,
         params={"page": "Traffic_Sources", "api_key": settings.BINOM_API_KEY, "status": "all"},
     )
 
     if not isinstance(all_traffic_sources, requests.Response):
         _logger.error(f"Network error occurred while trying to get traffic_sources from tracker: {all_traffic_sources}")
-        return []
+        return [], failed_users_ids
 
     try:
-        all_traffic_sources_number = len(all_traffic_sources.json())
+        all_traffic_sources_json = all_traffic_sources.json()
+        all_traffic_sources_ids = {traffic_source["id"] for traffic_source in all_traffic_sources_json}
     except json.JSONDecodeError as decode_error:
         _logger.error(
             f"Can't decode response from tracker (traffic sources getting): "
             f"{decode_error.doc}"
         )
-        return []
+        return [], failed_users_ids
+    except (KeyError, TypeError):
+        _logger.error(f"Can't parse response from tracker (traffic sources getting): {all_traffic_sources_json}")
+        return [], failed_users_ids
 
-    for user in User.objects.all():
-        user_traffic_sources = requests_manager.get(
-            session,
-            settings.TRACKER_URL,
-            params={
-                "page": "Traffic_Sources",
-                "api_key": settings.BINOM_API_KEY,
-                "user_group": user.id,
-                "status": "all",
-            },
-        )
+    if users is None:
+        users = list(User.objects.all())
+
+    users_traffic_sources = _map_parallel(_fetch_user_traffic_sources, users, max_workers)
+
+    for user, user_traffic_sources_json in zip(users, users_traffic_sources):
+        if isinstance(user_traffic_sources_json, json.JSONDecodeError):
+            _logger.error(
+                f"Can't decode response from tracker (traffic sources getting): {user_traffic_sources_json.doc}")
+            failed_users_ids.add(user.id)
+            continue
 
-        if not isinstance(user_traffic_sources, requests.Response):
+        if isinstance(user_traffic_sources_json, Exception):
             _logger.error(
-                f"Network error occurred while trying to get traffic sources from tracker: {user_traffic_sources}")
+                f"Network error occurred while trying to get traffic sources from tracker: {user_traffic_sources_json}")
+            failed_users_ids.add(user.id)
             continue
 
         try:
-            user_traffic_sources_json = user_traffic_sources.json()
-        except json.JSONDecodeError as decode_error:
+            if not user_traffic_sources_json or {traffic_source["id"] for traffic_source in
+                                                 user_traffic_sources_json} == all_traffic_sources_ids:
+                continue
+
+            user_traffic_sources = [
+                TrafficSource(
+                    id=int(traffic_source["id"]),
+                    name=traffic_source["name"],
+                    campaigns=int(traffic_source["camps"]),
+                    tokens=1 if int(traffic_source["tokens"]) else 0,
+                    user=user,
+                )
+                for traffic_source in user_traffic_sources_json
+            ]
+        except (KeyError, TypeError, ValueError):
             _logger.error(
-                f"Can't decode response from tracker (traffic sources getting): "
-                f"{decode_error.doc}"
-            )
-            return []
-
-        if user_traffic_sources_json and len(user_traffic_sources_json) != all_traffic_sources_number:
-            try:
-                result += [
-                    TrafficSource(
-                        id=int(traffic_source["id"]),
-                        name=traffic_source["name"],
-                        campaigns=int(traffic_source["camps"]),
-                        tokens=1 if int(traffic_source["tokens"]) else 0,
-                        user=user,
-                    )
-                    for traffic_source in user_traffic_sources_json
-                ]
-            except KeyError:
-                _logger.error(
-                    f"Can't parse response from tracker (traffic sources getting): {user_traffic_sources_json}")
-                return []
-
-    _logger.info("Traffic sources were successfully get.")
-    return result
+                f"Can't parse response from tracker (traffic sources getting): {user_traffic_sources_json}")
+            failed_users_ids.add(user.id)
+            continue
+
+        result += user_traffic_sources
+
+    if failed_users_ids:
+        _logger.warning(f"Traffic sources of users {sorted(failed_users_ids)} weren't get.")
+    else:
+        _logger.info("Traffic sources were successfully get.")
+
+    return result, failed_users_ids
 
 
 def get_offers_ids_by_campaign(campaign):
@@ -202,8 +259,8 @@ def get_offers_ids_by_campaign(campaign):
     result = []
 
     requests_url = settings.TRACKER_URL + "arm.php"
-    response = requests_manager.get(
-        requests.Session(),
+    response = get_client().get(
+        "campaign@get_full",
         requests_url,
         params={
             "page": "Campaigns",
@@ -236,9 +293,103 @@ def get_offers_ids_by_campaign(campaign):
     return result
 
 
-def get_campaigns(start_date, end_date, user, redis_server=None):
+def _map_parallel(function, items, max_workers=None):
+    """
+    Apply function to each item using bounded thread pool (for tracker requests), result keeps items order.
+
+    :param function: function to apply
+    :type function: Callable
+
+    :param items: items
+    :type items: List
+
+    :param max_workers: max number of parallel requests, settings.BINOM_CONCURRENCY by default
+    (1 means serial requests)
+    :type max_workers: int
+
+    :return: results for each item
+    :rtype: List
+    """
+
+    if max_workers is None:
+        max_workers = settings.BINOM_CONCURRENCY
+
+    if max_workers <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(function, items))
+
+
+def _request_shared(key, function):
     """
-    Get user campaigns from start_date to end_date.
+    Make tracker request by calling function. If request with the same key is already making by another thread
+    (e.g. concurrent fetches for several periods or users), waits for that request instead of making new one.
+
+    :param key: request key
+    :type key: Tuple
+
+    :param function: function, that makes request
+    :type function: Callable[[], Any]
+
+    :return: function result
+    """
+
+    with _shared_requests_lock:
+        future = _shared_requests.get(key)
+        is_owner = future is None
+
+        if is_owner:
+            future = Future()
+            _shared_requests[key] = future
+
+    if is_owner:
+        try:
+            future.set_result(function())
+        except Exception as exception:
+            future.set_exception(exception)
+        finally:
+            with _shared_requests_lock:
+                del _shared_requests[key]
+
+    return future.result()
+
+
+def _get_offers_ids_by_campaign_shared(campaign):
+    """
+    Get list of offers ids for taken campaign, request is shared with other threads (see _request_shared).
+
+    :param campaign: campaign
+    :type campaign: Campaign
+
+    :return: list of of offers ids
+    :rtype: List[int]
+    """
+
+    return list(_request_shared(("routing", campaign.id), lambda: get_offers_ids_by_campaign(campaign)))
+
+
+def get_offers_ids_by_campaigns(campaigns, max_workers=None):
+    """
+    Get lists of offers ids for taken campaigns. Requests are made in parallel, result keeps campaigns order.
+
+    :param campaigns: campaigns
+    :type campaigns: List[Campaign]
+
+    :param max_workers: max number of parallel requests
+    :type max_workers: int
+
+    :return: list of offers ids for each campaign
+    :rtype: List[List[int]]
+    """
+
+    return _map_parallel(_get_offers_ids_by_campaign_shared, campaigns, max_workers)
+
+
+def fetch_campaigns(start_date, end_date, user):
+    """
+    Get user campaigns statistics from start_date to end_date (without routing). Columnar batch of campaigns
+    is filled while response is parsed. Only tracker is requested (no database queries).
 
     :param start_date: period start date
     :type start_date: date
@@ -249,12 +400,8 @@ def get_campaigns(start_date, end_date, user, redis_server=None):
     :param user: user
     :type user: User
 
-    :param redis_server: RedisClient instance for caching
-    :type redis_server: RedisClient
-
-    :return: list of campaigns from tracker, each campaign is dict with 2 keys: instance - Campaign class instance
-    from models, offers_list - list of offers ids
-    :rtype: List[Dict[str, Union[CampaignTracker, List]]]
+    :return: list of campaigns from tracker ordered by id, None if campaigns can't be get
+    :rtype: Optional[CampaignList]
     """
 
     params = {
@@ -267,19 +414,12 @@ def get_campaigns(start_date, end_date, user, redis_server=None):
         "api_key": settings.BINOM_API_KEY,
     }
 
-    campaigns_db_ids = [campaign.id for campaign in
-                        list(Campaign.objects.filter(user_id=user.id).prefetch_related('offers_list'))]
-
-    _logger.info(f"Start getting campaigns from {start_date} to {end_date} for user {user}")
-
-    campaigns_tracker = requests_manager.get(
-        requests.Session(), f"{settings.TRACKER_URL}?timezone=+3:00&{urlencode(params)}"
-    )
+    campaigns_tracker = get_client().get("Campaigns", f"{settings.TRACKER_URL}?timezone=+3:00&{urlencode(params)}")
 
     if not isinstance(campaigns_tracker, requests.Response):
         _logger.error(
             f"Network error occurred while trying to get campaign full info from tracker: {campaigns_tracker}")
-        return []
+        return None
 
     try:
         campaigns_tracker_json = campaigns_tracker.json()
@@ -288,59 +428,202 @@ def get_campaigns(start_date, end_date, user, redis_server=None):
             f"Can't decode response from tracker (getting info about campaigns): "
             f"{decode_error.doc}"
         )
-        return []
+        return None
+
+    campaigns = []
+    ids, traffic_groups, traffic_source_ids, revenues, profits = [], [], [], [], []
 
     try:
-        result = [
-            {
-                "instance": Campaign(
-                    id=int(campaign["id"]),
-                    name=campaign["name"],
-                    traffic_group=campaign["group_name"],
-                    traffic_source_id=int(campaign["ts_id"]),
-                    revenue=Decimal(campaign["revenue"]),
-                    cost=Decimal(campaign["cost"]),
-                    profit=Decimal(campaign["profit"]),
-                    user=user,
-                ),
-                "offers_list": [],
-            }
-            for campaign in campaigns_tracker_json
-        ]
-    except KeyError:
+        # local statistics are ordered by id, so tests balances are spent in the same order for both sources
+        for campaign in sorted(campaigns_tracker_json, key=lambda campaign: int(campaign["id"])):
+            campaign_record = CampaignRecord(
+                id=int(campaign["id"]),
+                name=campaign["name"],
+                traffic_group=campaign["group_name"],
+                traffic_source_id=int(campaign["ts_id"]),
+                revenue=Decimal(campaign["revenue"]),
+                cost=Decimal(campaign["cost"]),
+                profit=Decimal(campaign["profit"]),
+                user_id=user.id,
+                clicks=int(campaign.get("clicks") or 0),
+            )
+
+            campaigns.append(campaign_record)
+            ids.append(campaign_record.id)
+            traffic_groups.append(campaign_record.traffic_group)
+            traffic_source_ids.append(campaign_record.traffic_source_id)
+            revenues.append(campaign["revenue"])
+            profits.append(campaign["profit"])
+    except (KeyError, TypeError):
         _logger.error(f"Can't parse response from tracker (campaigns getting): {campaigns_tracker_json}")
-        return []
+        return None
 
-    for campaign in result:
-        if redis_server:
-            if not redis_server.exists(campaign["instance"].id):
-                if campaign["instance"].id in campaigns_db_ids:
-                    offers_ids = [offer.id for offer in
-                                  Campaign.objects.get(id__exact=campaign["instance"].id).offers_list.all()]
+    return CampaignList(campaigns, CampaignBatch.from_columns(ids, traffic_groups, traffic_source_ids, revenues,
+                                                              profits))
 
-                else:
-                    offers_ids = get_offers_ids_by_campaign(campaign["instance"])
 
-                redis_server.add_campaign_offers(campaign["instance"].id, offers_ids)
-            else:
-                offers_ids = redis_server.get_campaign_offers(campaign["instance"].id)
-        else:
-            if campaign["instance"].id in campaigns_db_ids:
-                offers_ids = [offer.id for offer in
-                              Campaign.objects.get(id__exact=campaign["instance"].id).offers_list.all()]
+def get_campaigns_db_offers(user):
+    """
+    Get offers ids of user campaigns saved in database (routing for campaigns which aren't cached).
+
+    :param user: user
+    :type user: User
+
+    :return: offers ids for each campaign id
+    :rtype: Dict[int, List[int]]
+    """
+
+    return {campaign.id: [offer.id for offer in campaign.offers_list.all()] for campaign in
+            Campaign.objects.filter(user_id=user.id).prefetch_related('offers_list')}
+
+
+def attach_campaigns_offers(campaigns, campaigns_db_offers, redis_server=None, max_workers=None):
+    """
+    Set offers ids (routing) of each campaign. Routing is taken from Redis cache, then from database offers ids,
+    then from tracker. Database isn't queried here, so function can be run in any thread.
+
+    :param campaigns: campaigns from tracker
+    :type campaigns: List[CampaignRecord]
+
+    :param campaigns_db_offers: offers ids for each campaign id saved in database
+    :type campaigns_db_offers: Dict[int, List[int]]
+
+    :param redis_server: RedisClient instance for caching
+    :type redis_server: RedisClient
+
+    :param max_workers: max number of parallel requests for campaigns routing
+    :type max_workers: int
+
+    :return: None
+    """
+
+    campaigns_without_offers = []
+    offers_to_cache = {}
+
+    if redis_server:
+        cached_offers = redis_server.get_campaigns_offers([campaign.id for campaign in campaigns])
+    else:
+        cached_offers = {}
 
-            else:
-                offers_ids = get_offers_ids_by_campaign(campaign["instance"])
+    for campaign in campaigns:
+        offers_ids = cached_offers.get(campaign.id)
+
+        if offers_ids is None:
+            if campaign.id not in campaigns_db_offers:
+                campaigns_without_offers.append(campaign)
+                continue
+
+            offers_ids = campaigns_db_offers[campaign.id]
+            offers_to_cache[campaign.id] = offers_ids
 
         # if not offers_ids:
         #     return []
 
-        campaign["offers_list"] = deepcopy(offers_ids)
+        # offers ids can be shared with routing cache, so they are kept immutable
+        campaign.offers_list = tuple(offers_ids)
+
+    offers_ids_list = get_offers_ids_by_campaigns(campaigns_without_offers, max_workers)
+
+    for campaign, offers_ids in zip(campaigns_without_offers, offers_ids_list):
+        # empty list can be result of network error, so it's not cached
+        if offers_ids:
+            offers_to_cache[campaign.id] = offers_ids
+
+        campaign.offers_list = tuple(offers_ids)
+
+    if redis_server:
+        redis_server.add_campaigns_offers(offers_to_cache)
+
+
+def get_campaigns(start_date, end_date, user, redis_server=None, max_workers=None, with_offers=True,
+                  raise_on_error=False):
+    """
+    Get user campaigns from start_date to end_date. If settings.CAMPAIGNS_SOURCE is "local", campaigns statistics
+    is taken from local daily statistics (if it covers the period), else from tracker.
+
+    :param start_date: period start date
+    :type start_date: date
+
+    :param end_date: period end date
+    :type end_date: date
+
+    :param user: user
+    :type user: User
+
+    :param redis_server: RedisClient instance for caching
+    :type redis_server: RedisClient
+
+    :param max_workers: max number of parallel requests for campaigns routing
+    :type max_workers: int
+
+    :param with_offers: get campaigns routing (offers ids), it isn't needed e.g. for profit calculation
+    :type with_offers: bool
+
+    :param raise_on_error: raise UpdateError, if campaigns can't be get (else empty list is returned)
+    :type raise_on_error: bool
+
+    :return: list of campaigns from tracker with offers ids (ordered by id)
+    :rtype: List[CampaignRecord]
+    """
+
+    _logger.info(f"Start getting campaigns from {start_date} to {end_date} for user {user}")
+
+    result = None
+
+    if settings.CAMPAIGNS_SOURCE == "local":
+        result = get_local_campaigns(start_date, end_date, user)
+
+        if result is None:
+            _logger.warning(f"Local statistics doesn't cover period from {start_date} to {end_date} for user {user}, "
+                            f"campaigns are taken from tracker.")
+
+    if result is None:
+        result = fetch_campaigns(start_date, end_date, user)
+
+    if result is None:
+        if raise_on_error:
+            raise UpdateError(message=f"Can't get campaigns from {start_date} to {end_date} for user {user}")
+
+        return []
+
+    if not with_offers:
+        _logger.info(f"Campaigns for {user} from {start_date} to {end_date} were successfully get (without routing).")
+        return result
+
+    attach_campaigns_offers(result, get_campaigns_db_offers(user), redis_server, max_workers)
 
     _logger.info(f"Campaigns for {user} from {start_date} to {end_date} were successfully get.")
     return result
 
 
+def get_campaigns_daily_stats(days, user, max_workers=None):
+    """
+    Get user campaigns statistics for each day (without routing). Tracker can't return statistics split
+    by days for all campaigns at once, so each day is requested separately (requests are made in parallel).
+
+    :param days: days
+    :type days: List[date]
+
+    :param user: user
+    :type user: User
+
+    :param max_workers: max number of parallel requests
+    :type max_workers: int
+
+    :return: list of campaigns with statistics for each day, None if statistics for some day can't be get
+    :rtype: Optional[Dict[date, List[CampaignRecord]]]
+    """
+
+    _logger.info(f"Start getting campaigns statistics for {len(days)} days for user {user}")
+
+    days_campaigns = _map_parallel(lambda day: fetch_campaigns(day, day, user), days, max_workers)
+
+    if any(campaigns is None for campaigns in days_campaigns):
+        return None
+
+    return dict(zip(days, days_campaigns))
+
+
 def get_campaign_main_geo(campaign, start_date, end_date):
     """
     Get campaign's geo statistics and finds main geo (max clicks geo) based on period.
@@ -374,7 +657,7 @@ def get_campaign_main_geo(campaign, start_date, end_date):
         }
     )
 
-    campaign_statistics = requests_manager.get(requests.Session(), f"{settings.TRACKER_URL}?{params}&timezone=+3:00")
+    campaign_statistics = get_client().get("Stats", f"{settings.TRACKER_URL}?{params}&timezone=+3:00")
 
     if not isinstance(campaign_statistics, requests.Response):
         _logger.error(
@@ -399,3 +682,40 @@ def get_campaign_main_geo(campaign, start_date, end_date):
     except TypeError:
         _logger.warning(f"Can't get campaign main geo, campaign id: {campaign.id}. Maybe, this campaign is empty?")
         return None
+
+
+def get_campaigns_main_geos(campaigns, start_date, end_date, max_workers=None):
+    """
+    Get main geo (max clicks geo) for each of taken campaigns based on period.
+    Tracker statistics page is built for single campaign, so requests for all campaigns are made in parallel
+    as one batch (at most max_workers requests at once). Each campaign is requested once, campaign, that is
+    already requesting by another thread for the same period, isn't requested again.
+
+    :param campaigns: campaigns
+    :type campaigns: List[Campaign]
+
+    :param start_date: period start date
+    :type start_date: date
+
+    :param end_date: period end date
+    :type end_date: date
+
+    :param max_workers: max number of parallel requests
+    :type max_workers: int
+
+    :return: main geo for each campaign id (-1 if can't get it, None if campaign has no clicks)
+    :rtype: Dict[int, Union[int, str, None]]
+    """
+
+    _logger.info(f"Start getting main geo for {len(campaigns)} campaigns from {start_date} to {end_date}")
+
+    campaigns = list({campaign.id: campaign for campaign in campaigns}.values())
+
+    main_geos = _map_parallel(
+        lambda campaign: _request_shared(("main_geo", campaign.id, start_date, end_date),
+                                         lambda: get_campaign_main_geo(campaign, start_date, end_date)),
+        campaigns,
+        max_workers,
+    )
+
+    return {campaign.id: main_geo for campaign, main_geo in zip(campaigns, main_geos)}
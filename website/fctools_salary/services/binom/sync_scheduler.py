@@ -0,0 +1,137 @@
+# Copyright © 2020-2021 Filthy Claws Tools - All Rights Reserved
+#
+# This file is part of FCTools_payroll
+#
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Author: German Yakimov <german13yakimov@gmail.com>
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+from redis import RedisError
+from redis.exceptions import LockError
+
+from fctools_salary.services.binom.update import update_basic_info
+from fctools_salary.services.helpers.redis_client import RedisClient
+
+_logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_pid = None
+_pending = None
+_executor_lock = threading.Lock()
+
+
+def is_basic_info_fresh(max_age=None):
+    """
+    :param max_age: max age of synced info in seconds, settings.BASIC_INFO_MAX_AGE by default
+    :type max_age: Optional[int]
+
+    :return: True, if users, offers and traffic sources were synced less than max_age seconds ago
+    :rtype: bool
+    """
+
+    if max_age is None:
+        max_age = settings.BASIC_INFO_MAX_AGE
+
+    try:
+        synced_at = RedisClient().get_basic_info_synced_at()
+    except RedisError as error:
+        _logger.error(f"Can't get last syncing time: {error}")
+        return False
+
+    return synced_at is not None and time.time() - synced_at < max_age
+
+
+def sync_basic_info(force=False, wait=True):
+    """
+    Sync users, offers and traffic sources with tracker, if they are stale (or if syncing is forced).
+    Only one process syncs at once, other processes wait for it (or skip syncing, if wait is False).
+
+    :param force: sync even if info is fresh
+    :type force: bool
+
+    :param wait: wait for syncing, that is started by other process
+    :type wait: bool
+
+    :return: numbers of created, updated and deleted rows for each table, None if syncing was skipped
+    :rtype: Optional[Dict[str, Dict[str, int]]]
+    """
+
+    if not force and is_basic_info_fresh():
+        _logger.info("Users, offers and traffic sources are fresh, syncing is skipped.")
+        return None
+
+    redis_client = RedisClient()
+    lock = redis_client.basic_info_sync_lock()
+
+    try:
+        acquired = lock.acquire(blocking=wait, blocking_timeout=settings.BASIC_INFO_SYNC_LOCK_TTL)
+    except RedisError as error:
+        _logger.error(f"Can't get syncing lock, sync without it: {error}")
+        return update_basic_info()
+
+    if not acquired:
+        _logger.info("Users, offers and traffic sources are being synced by other process.")
+        return None
+
+    try:
+        # info may be synced by other process, while this one was waiting for lock
+        if not force and is_basic_info_fresh():
+            return None
+
+        counts = update_basic_info()
+        redis_client.set_basic_info_synced_at(time.time())
+
+        return counts
+    finally:
+        try:
+            lock.release()
+        except LockError:
+            _logger.warning("Syncing lock expired before syncing was finished.")
+
+
+def _sync_in_background(force):
+    try:
+        sync_basic_info(force=force, wait=False)
+    except Exception as exception:
+        _logger.error(f"Background syncing failed: {exception}")
+    finally:
+        connections.close_all()
+
+
+def request_basic_info_sync(force=False):
+    """
+    Start syncing of users, offers and traffic sources in background thread, if they are stale
+    (or if syncing is forced). Doesn't wait for syncing, only one syncing is started by process at once.
+
+    :param force: sync even if info is fresh
+    :type force: bool
+
+    :return: True, if syncing was started
+    :rtype: bool
+    """
+
+    global _executor, _executor_pid, _pending
+
+    if not force and is_basic_info_fresh():
+        return False
+
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="basic-info-sync")
+            _executor_pid = os.getpid()
+            _pending = None
+
+        if _pending is not None and not _pending.done():
+            return False
+
+        _pending = _executor.submit(_sync_in_background, force)
+
+    return True
@@ -7,101 +7,288 @@
 # Author: German Yakimov <german13yakimov@gmail.com>
 
 import logging
+from datetime import datetime, timedelta
 
+from django.conf import settings
 from django.db import transaction
+from django.db.models import Max, Q
 
 from fctools_salary.domains.accounts.user import User
+from fctools_salary.domains.tracker.campaign_daily_stat import CampaignDailyStat
 from fctools_salary.domains.tracker.offer import Offer
 from fctools_salary.domains.tracker.traffic_source import TrafficSource
 from fctools_salary.exceptions import UpdateError
-from fctools_salary.services.binom.get_info import get_users, get_offers, get_traffic_sources
+from fctools_salary.services.binom.get_info import (
+    get_users, get_offers, get_traffic_sources, get_campaigns_daily_stats, get_campaigns_main_geos
+)
+from fctools_salary.services.helpers.daily_stats import days_of_periods
 
 _logger = logging.getLogger(__name__)
 
 
+def _sync_table(model, tracker_rows, fields, deletable=None):
+    """
+    Synchronize database table with rows from tracker by primary keys: new rows are inserted, rows with changed
+    fields are updated, rows, that are absent in tracker, are deleted (only if settings.SYNC_DELETE_MISSING is True).
+
+    :param model: model of table
+    :type model: Type[models.Model]
+
+    :param tracker_rows: unsaved model instances from tracker
+    :type tracker_rows: List[models.Model]
+
+    :param fields: names of fields, that are taken from tracker (other fields of existing rows are kept)
+    :type fields: List[str]
+
+    :param deletable: condition of rows, that may be deleted (all rows by default)
+    :type deletable: Q
+
+    :return: numbers of created, updated and deleted rows
+    :rtype: Dict[str, int]
+    """
+
+    # foreign keys are compared and copied by ids, so related objects aren't loaded
+    attnames = [model._meta.get_field(field).attname for field in fields]
+
+    tracker_map = {row.pk: row for row in tracker_rows}
+    db_map = model.objects.in_bulk()
+
+    to_create = [row for pk, row in tracker_map.items() if pk not in db_map]
+    to_update = []
+
+    for pk, row in tracker_map.items():
+        db_row = db_map.get(pk)
+
+        if db_row is not None and any(getattr(db_row, attname) != getattr(row, attname) for attname in attnames):
+            for attname in attnames:
+                setattr(db_row, attname, getattr(row, attname))
+
+            to_update.append(db_row)
+
+    to_delete = []
+
+    if settings.SYNC_DELETE_MISSING:
+        deletable_pks = db_map if deletable is None else model.objects.filter(deletable).values_list("pk", flat=True)
+        to_delete = [pk for pk in deletable_pks if pk not in tracker_map]
+
+    with transaction.atomic():
+        model.objects.bulk_create(to_create)
+
+        if to_update:
+            model.objects.bulk_update(to_update, fields)
+
+        if to_delete:
+            model.objects.filter(pk__in=to_delete).delete()
+
+    return {"created": len(to_create), "updated": len(to_update), "deleted": len(to_delete)}
+
+
 def _update_users():
     """
     Synchronize users table in tracker with database.
+    Only logins are taken from tracker, salary groups and balances of existing users are kept.
 
-    :return: None
+    :return: numbers of created, updated and deleted users
+    :rtype: Dict[str, int]
     """
 
     _logger.info("Start to sync users.")
 
-    users_db = User.objects.all()
     users_tracker = get_users()
 
     if not users_tracker:
         _logger.error("Can't get users from tracker.")
         raise UpdateError(message="Can't sync users from tracker.")
 
-    with transaction.atomic():
-        for user in users_tracker:
-            if user not in users_db:
-                user.save()
+    counts = _sync_table(User, users_tracker, ["login"])
+
+    _logger.info(f"Users syncing was successful: {counts}.")
 
-    _logger.info("Users syncing was successful.")
+    return counts
 
 
 def update_offers():
     """
     Synchronize offers table in tracker with database.
 
-    :return: None
+    :return: numbers of created, updated and deleted offers
+    :rtype: Dict[str, int]
     """
 
     _logger.info("Start to sync offers.")
 
-    offers_db = Offer.objects.all()
     offers_tracker = get_offers()
 
     if not offers_tracker:
         _logger.error("Can't get offers from tracker.")
         raise UpdateError(message="Can't sync offers from tracker.")
 
-    with transaction.atomic():
-        for offer in offers_tracker:
-            if offer not in offers_db:
-                offer.save()
+    counts = _sync_table(Offer, offers_tracker, ["geo", "name", "group", "network"])
+
+    _logger.info(f"Offers syncing was successful: {counts}.")
 
-    _logger.info("Offers syncing was successful.")
+    return counts
 
 
 def _update_traffic_sources():
     """
     Synchronize traffic sources table in tracker with database.
 
-    :return: None
+    :return: numbers of created, updated and deleted traffic sources
+    :rtype: Dict[str, int]
     """
 
     _logger.info("Start to sync traffic sources.")
 
-    traffic_sources_db = TrafficSource.objects.all()
-    traffic_sources_tracker = get_traffic_sources()
+    if settings.TRAFFIC_SOURCES_OWNERS == "active":
+        # traffic sources of other users aren't requested from tracker, so they are kept
+        owners = list(User.objects.filter(salary_group__gt=0))
+        deletable = Q(user__salary_group__gt=0)
+    else:
+        owners = list(User.objects.all())
+        deletable = Q()
+
+    if not owners:
+        _logger.info("There are no owners of traffic sources to sync.")
+        return {"created": 0, "updated": 0, "deleted": 0}
+
+    traffic_sources_tracker, failed_owners_ids = get_traffic_sources(owners)
 
     if not traffic_sources_tracker:
         _logger.error("Can't get traffic sources from tracker.")
         raise UpdateError(message="Can't sync traffic sources from tracker.")
 
-    with transaction.atomic():
-        for ts in traffic_sources_tracker:
-            if ts not in traffic_sources_db:
-                ts.save()
+    if failed_owners_ids:
+        # traffic sources of these users are absent in result, but they aren't deleted in tracker
+        deletable &= ~Q(user__in=failed_owners_ids)
+
+    counts = _sync_table(TrafficSource, traffic_sources_tracker, ["user", "name", "tokens", "campaigns"], deletable)
 
-    _logger.info("Traffic sources syncing was successful.")
+    _logger.info(f"Traffic sources syncing was successful: {counts}.")
+
+    return counts
 
 
 def update_basic_info():
     """
     Synchronize users, offers and traffic sources tables in tracker with database.
 
-    :return: None
+    :return: numbers of created, updated and deleted rows for each table
+    :rtype: Dict[str, Dict[str, int]]
     """
 
     _logger.info("Start to sync database and tracker.")
 
-    _update_users()
-    _update_traffic_sources()
-    update_offers()
+    counts = {
+        "users": _update_users(),
+        "traffic_sources": _update_traffic_sources(),
+        "offers": update_offers(),
+    }
 
     _logger.info("Syncing was successful.")
+
+    return counts
+
+
+def update_daily_stats(user, start_date, end_date, with_main_geo=False):
+    """
+    Replace local daily statistics of user campaigns from start_date to end_date with statistics from tracker.
+
+    :param user: user
+    :type user: User
+
+    :param start_date: first day
+    :type start_date: date
+
+    :param end_date: last day
+    :type end_date: date
+
+    :param with_main_geo: get main geo of each campaign for each day (one more request for each campaign and day)
+    :type with_main_geo: bool
+
+    :return: number of saved rows
+    :rtype: int
+    """
+
+    _logger.info(f"Start to sync daily statistics from {start_date} to {end_date} for user {user}.")
+
+    days_campaigns = get_campaigns_daily_stats(days_of_periods([(start_date, end_date)]), user)
+
+    if days_campaigns is None:
+        _logger.error(f"Can't get daily statistics from {start_date} to {end_date} for user {user}.")
+        raise UpdateError(message=f"Can't sync daily statistics from tracker for user {user}.")
+
+    stats = []
+
+    for day, campaigns in days_campaigns.items():
+        main_geos = {}
+
+        if with_main_geo:
+            main_geos = get_campaigns_main_geos([campaign for campaign in campaigns if campaign.clicks], day, day)
+
+        for campaign in campaigns:
+            main_geo = main_geos.get(campaign.id)
+
+            stats.append(
+                CampaignDailyStat(
+                    campaign_id=campaign.id,
+                    user_id=user.id,
+                    name=campaign.name,
+                    traffic_group=campaign.traffic_group,
+                    traffic_source_id=campaign.traffic_source_id,
+                    day=day,
+                    revenue=campaign.revenue,
+                    cost=campaign.cost,
+                    profit=campaign.profit,
+                    clicks=campaign.clicks,
+                    main_geo=main_geo if main_geo != -1 else None,
+                )
+            )
+
+    with transaction.atomic():
+        CampaignDailyStat.objects.filter(user=user, day__range=(start_date, end_date)).delete()
+        CampaignDailyStat.objects.bulk_create(stats, batch_size=1000)
+
+    _logger.info(f"Daily statistics syncing for user {user} was successful, rows: {len(stats)}.")
+
+    return len(stats)
+
+
+def sync_daily_stats(users=None, with_main_geo=False):
+    """
+    Incrementally update local daily statistics up to today: days after last synced day and
+    last settings.DAILY_STATS_REFRESH_DAYS synced days (they can change because of late conversions).
+    For user without statistics settings.DAILY_STATS_INITIAL_DAYS days are synced.
+
+    :param users: users, all active users (salary group > 0) by default
+    :type users: List[User]
+
+    :param with_main_geo: get main geo of each campaign for each day
+    :type with_main_geo: bool
+
+    :return: number of saved rows for each user id
+    :rtype: Dict[int, int]
+    """
+
+    if users is None:
+        users = list(User.objects.filter(salary_group__gt=0))
+
+    today = datetime.utcnow().date()
+    last_days = dict(
+        CampaignDailyStat.objects.filter(user__in=users).values("user_id").annotate(last_day=Max("day"))
+        .values_list("user_id", "last_day")
+    )
+
+    result = {}
+
+    for user in users:
+        last_day = last_days.get(user.id)
+
+        if last_day is None:
+            start_date = today - timedelta(days=settings.DAILY_STATS_INITIAL_DAYS)
+        else:
+            start_date = min(last_day, today) - timedelta(days=settings.DAILY_STATS_REFRESH_DAYS)
+
+        result[user.id] = update_daily_stats(user, start_date, today, with_main_geo)
+
+    return result
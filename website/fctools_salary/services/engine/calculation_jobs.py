@@ -0,0 +1,327 @@
+# Copyright © 2020-2021 Filthy Claws Tools - All Rights Reserved
+#
+# This file is part of FCTools_payroll
+#
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Author: German Yakimov <german13yakimov@gmail.com>
+
+import logging
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from redis import RedisError
+
+from fctools_salary.domains.accounts.calculation_job import CalculationJob
+from fctools_salary.services.binom.sync_scheduler import sync_basic_info
+from fctools_salary.services.engine.engine import calculate_user_salary
+from fctools_salary.services.engine.payroll import calculate_payroll
+from fctools_salary.services.helpers.redis_client import RedisClient
+
+_logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+# ids of jobs, that are running in current process
+_running_jobs = set()
+_running_jobs_lock = threading.Lock()
+
+
+def _get_executor():
+    """
+    Get process-wide pool of calculation workers (settings.CALCULATION_WORKERS threads).
+    Pool is created again after fork (e.g. in uWSGI workers). When pool starts, it also starts heartbeat
+    of running jobs and recovers jobs, that were left by stopped processes (see _recover_jobs()).
+
+    :return: pool
+    :rtype: ThreadPoolExecutor
+    """
+
+    global _executor, _executor_pid
+
+    with _executor_lock:
+        if _executor is not None and _executor_pid == os.getpid():
+            return _executor
+
+        _executor = ThreadPoolExecutor(max_workers=settings.CALCULATION_WORKERS, thread_name_prefix="calculation-job")
+        _executor_pid = os.getpid()
+        executor = _executor
+
+        with _running_jobs_lock:
+            _running_jobs.clear()
+
+        threading.Thread(target=_heartbeat, args=(_executor_pid,), name="calculation-heartbeat", daemon=True).start()
+
+    _recover_jobs(executor)
+
+    return executor
+
+
+def _heartbeat(pid):
+    """
+    Update heartbeat time of jobs, that are running in current process, every
+    settings.CALCULATION_HEARTBEAT_INTERVAL seconds (until process is forked).
+    """
+
+    while _executor_pid == pid:
+        time.sleep(settings.CALCULATION_HEARTBEAT_INTERVAL)
+
+        with _running_jobs_lock:
+            jobs_ids = list(_running_jobs)
+
+        if not jobs_ids:
+            continue
+
+        try:
+            CalculationJob.objects.filter(id__in=jobs_ids, status=CalculationJob.RUNNING).update(
+                heartbeat_at=timezone.now()
+            )
+        except DatabaseError as error:
+            _logger.error(f"Can't update heartbeat of calculation jobs {jobs_ids}: {error}")
+        finally:
+            connections.close_all()
+
+
+def _fail_interrupted_jobs():
+    """
+    Mark running jobs without heartbeat for settings.CALCULATION_HEARTBEAT_TIMEOUT seconds as failed
+    (process, that was running them, was stopped).
+
+    :return: number of failed jobs
+    :rtype: int
+    """
+
+    now = timezone.now()
+    deadline = now - timedelta(seconds=settings.CALCULATION_HEARTBEAT_TIMEOUT)
+
+    failed = CalculationJob.objects.filter(
+        Q(heartbeat_at__lt=deadline) | Q(heartbeat_at__isnull=True, started_at__lt=deadline),
+        status=CalculationJob.RUNNING,
+    ).update(
+        status=CalculationJob.FAILED, error="Calculation was interrupted: process, that was running it, was stopped.",
+        finished_at=now,
+    )
+
+    if failed:
+        _logger.warning(f"{failed} interrupted calculation jobs were marked as failed.")
+
+    return failed
+
+
+def _recover_jobs(executor):
+    """
+    Mark interrupted jobs as failed and pass jobs, that are left queued (e.g. server was restarted before
+    they were started), to workers pool. Job may be passed to several pools, but it runs only once.
+    """
+
+    try:
+        _fail_interrupted_jobs()
+
+        for queued_job_id in CalculationJob.objects.filter(status=CalculationJob.QUEUED).values_list("id", flat=True):
+            executor.submit(_run_job, queued_job_id)
+    except DatabaseError as error:
+        _logger.error(f"Can't recover calculation jobs: {error}")
+
+
+def _submit(job_id):
+    """
+    Pass job to workers pool.
+    """
+
+    _get_executor().submit(_run_job, job_id)
+
+
+def _set_progress(redis_client, job_id, stage, progress):
+    try:
+        redis_client.set_job_progress(job_id, stage, progress)
+    except RedisError as exception:
+        _logger.warning(f"Can't save progress of calculation job {job_id}: {exception}")
+
+
+def _run_job(job_id):
+    """
+    Execute calculation job: update database from tracker and calculate user salary (in one transaction),
+    or calculate payroll for users of payroll job (in current process, each user in separate transaction).
+    Job is claimed by status update, so each job runs only once, even if it was passed to several workers.
+
+    :param job_id: calculation job id
+    :type job_id: UUID
+    """
+
+    try:
+        now = timezone.now()
+        claimed = CalculationJob.objects.filter(id=job_id, status=CalculationJob.QUEUED).update(
+            status=CalculationJob.RUNNING, started_at=now, heartbeat_at=now
+        )
+
+        if not claimed:
+            return
+
+        with _running_jobs_lock:
+            _running_jobs.add(job_id)
+
+        job = CalculationJob.objects.select_related("user").get(id=job_id)
+        redis_client = RedisClient()
+
+        def progress(stage, percent):
+            _set_progress(redis_client, job_id, stage, percent)
+
+        _logger.info(f"Start calculation job {job_id}: {job}")
+
+        try:
+            if job.is_payroll:
+                results = calculate_payroll(job.start_date, job.end_date, job.commit, job.traffic_groups,
+                                            users=list(job.users.order_by("id")), workers=1, progress=progress)
+                result = {"users": list(results.values())}
+            else:
+                progress("Updating database from tracker", 0)
+                sync_basic_info()
+
+                with transaction.atomic():
+                    result = calculate_user_salary(job.user, job.start_date, job.end_date, job.commit,
+                                                   job.traffic_groups, progress=progress)
+
+            progress("Done", 100)
+            CalculationJob.objects.filter(id=job_id).update(status=CalculationJob.DONE, result=result,
+                                                            finished_at=timezone.now())
+
+            _logger.info(f"Calculation job {job_id} is done.")
+        except Exception as exception:
+            _logger.error(f"Calculation job {job_id} failed: {exception}")
+            CalculationJob.objects.filter(id=job_id).update(status=CalculationJob.FAILED, error=str(exception),
+                                                            traceback=traceback.format_exc(),
+                                                            finished_at=timezone.now())
+    finally:
+        with _running_jobs_lock:
+            _running_jobs.discard(job_id)
+
+        connections.close_all()
+
+
+def enqueue_calculation(user, start_date, end_date, commit, traffic_groups):
+    """
+    Create calculation job, it's passed to workers after current transaction commit.
+
+    :param user: user
+    :type user: User
+
+    :param start_date: period start date
+    :type start_date: date
+
+    :param end_date: period end date
+    :type end_date: date
+
+    :param commit: save changes to database
+    :type commit: bool
+
+    :param traffic_groups: traffic groups that includes in calculation
+    :type traffic_groups: List[str]
+
+    :return: created job
+    :rtype: CalculationJob
+    """
+
+    job = CalculationJob.objects.create(user=user, start_date=start_date, end_date=end_date, commit=commit,
+                                        traffic_groups=list(traffic_groups))
+    transaction.on_commit(lambda: _submit(job.id))
+
+    return job
+
+
+def enqueue_payroll(users, start_date, end_date, commit, traffic_groups):
+    """
+    Create payroll job for several users (they share syncing with tracker, campaigns fetching, tests loading
+    and subordinates profits), it's passed to workers after current transaction commit.
+
+    :param users: users
+    :type users: List[User]
+
+    :param start_date: period start date
+    :type start_date: date
+
+    :param end_date: period end date
+    :type end_date: date
+
+    :param commit: save changes to database
+    :type commit: bool
+
+    :param traffic_groups: traffic groups that includes in calculation
+    :type traffic_groups: List[str]
+
+    :return: created job
+    :rtype: CalculationJob
+    """
+
+    job = CalculationJob.objects.create(start_date=start_date, end_date=end_date, commit=commit,
+                                        traffic_groups=list(traffic_groups))
+    job.users.set(users)
+    transaction.on_commit(lambda: _submit(job.id))
+
+    return job
+
+
+def get_job_status(job):
+    """
+    :param job: calculation job
+    :type job: CalculationJob
+
+    :return: job status, current stage and progress in percents, error message (if job failed)
+    :rtype: Dict[str, Any]
+    """
+
+    if not job.finished:
+        # status page starts workers pool of current process, so queued jobs are taken after server restart,
+        # and finds jobs, that were interrupted
+        _get_executor()
+
+        if job.status == CalculationJob.RUNNING:
+            _fail_interrupted_jobs()
+            job.refresh_from_db()
+
+    stage, progress = None, 0
+
+    if job.status == CalculationJob.DONE:
+        stage, progress = "Done", 100
+    elif job.status == CalculationJob.RUNNING:
+        try:
+            stage, progress = RedisClient().get_job_progress(job.id)
+        except RedisError as exception:
+            _logger.warning(f"Can't get progress of calculation job {job.id}: {exception}")
+
+    return {
+        "id": str(job.id),
+        "status": job.status,
+        "stage": stage,
+        "progress": progress,
+        "error": job.error,
+    }
+
+
+def get_job_result(job):
+    """
+    :param job: done calculation job
+    :type job: CalculationJob
+
+    :return: calculation result (context for result page), for payroll job - list of results
+        (or error messages) of users
+    :rtype: Dict[str, Any]
+    """
+
+    if job.is_payroll:
+        return {"start_date": job.start_date, "end_date": job.end_date, "results": job.result["users"]}
+
+    result = dict(job.result)
+    result["start_date"] = date.fromisoformat(result["start_date"])
+    result["end_date"] = date.fromisoformat(result["end_date"])
+
+    return result
@@ -6,22 +6,27 @@
 # Proprietary and confidential
 # Author: German Yakimov <german13yakimov@gmail.com>
 
+import asyncio
 import logging
 from datetime import date
 from typing import List, Dict
 
+from asgiref.sync import async_to_sync, sync_to_async
 from django.conf import settings
 from django.db import transaction
 
 from fctools_salary.domains.accounts.percent_dependency import PercentDependency
-from fctools_salary.domains.accounts.test import Test
 from fctools_salary.domains.tracker.campaign import Campaign
 from fctools_salary.domains.tracker.offer import Offer
-from fctools_salary.services.binom.get_info import get_campaigns
+from fctools_salary.domains.tracker.traffic_source import TrafficSource
+from fctools_salary.exceptions import UpdateError
+from fctools_salary.services.binom import async_get_info
+from fctools_salary.services.binom.sync_scheduler import sync_basic_info
 from fctools_salary.services.binom.update import update_offers
 from fctools_salary.services.engine.tests_manager import TestsManager
 from fctools_salary.services.engine.tracker_manager import TrackerManager
-from fctools_salary.services.helpers.redis_client import RedisClient
+from fctools_salary.services.helpers.campaign_batch import CampaignBatch
+from fctools_salary.services.helpers.redis_client import RedisClient, invalidate_campaigns_offers_on_commit
 from fctools_salary.services.helpers.report import Report as Rp
 
 _logger = logging.getLogger(__name__)
@@ -95,7 +100,7 @@ def _set_start_balances(user, traffic_groups):
     return result
 
 
-def _calculate_teamlead_profit_from_other_users(start_date, end_date, user, traffic_groups):
+def _calculate_teamlead_profit_from_other_users(start_date, end_date, user, traffic_groups, profit_memo):
     """
     Calculate teamlead profit from other users.
 
@@ -111,18 +116,22 @@ def _calculate_teamlead_profit_from_other_users(start_date, end_date, user, traf
     :param traffic_groups: traffic groups that includes in calculation
     :type traffic_groups: List[str]
 
+    :param profit_memo: RedisClient instance, that keeps users profits with tests calculated in this run
+    :type profit_memo: RedisClient
+
     :return: profit from other users with detailed calculation (split by traffic groups)
     :rtype: Dict[str, List[Union[str, float]]]
     """
 
     from_other_users = {traffic_group: ["", 0.0] for traffic_group in traffic_groups}
 
-    dependencies_list = PercentDependency.objects.all().filter(to_user=user)
+    dependencies_list = list(PercentDependency.objects.filter(to_user=user).select_related("from_user"))
+    profits_with_tests = TestsManager.calculate_profits_with_tests(
+        [dependency.from_user for dependency in dependencies_list], start_date, end_date, traffic_groups, profit_memo
+    )
 
     for dependency in dependencies_list:
-        TestsManager.archive_user_tests(dependency.from_user)
-        profit_with_tests = TestsManager.calculate_profit_with_tests(dependency.from_user, start_date, end_date,
-                                                                     traffic_groups)
+        profit_with_tests = profits_with_tests[dependency.from_user.id]
 
         for traffic_group in profit_with_tests:
             profit_from_user = round(profit_with_tests[traffic_group] * dependency.percent, 6)
@@ -145,42 +154,198 @@ def _calculate_teamlead_profit_from_other_users(start_date, end_date, user, traf
     return from_other_users
 
 
+def _get_offers(offers_ids):
+    """
+    Get offers by ids by one query. If some offers are unknown, offers table is synchronized with tracker once.
+
+    :param offers_ids: offers ids
+    :type offers_ids: Set[int]
+
+    :return: offer for each found offer id
+    :rtype: Dict[int, Offer]
+    """
+
+    offers = Offer.objects.in_bulk(offers_ids)
+
+    if len(offers) < len(offers_ids):
+        update_offers()
+        offers = Offer.objects.in_bulk(offers_ids)
+
+    return offers
+
+
+def _check_traffic_sources(traffic_sources_ids):
+    """
+    Check, that traffic sources exist in database. Synced info may be fresh (settings.BASIC_INFO_MAX_AGE),
+    but miss traffic sources, that were added in tracker after syncing, so info is synchronized with tracker once.
+
+    :param traffic_sources_ids: traffic sources ids
+    :type traffic_sources_ids: Set[int]
+
+    :return: None
+    """
+
+    def get_missing():
+        return traffic_sources_ids - set(TrafficSource.objects.filter(id__in=traffic_sources_ids)
+                                         .values_list("id", flat=True))
+
+    if not get_missing():
+        return
+
+    sync_basic_info(force=True)
+    missing = get_missing()
+
+    if missing:
+        _logger.error(f"Campaigns have unknown traffic sources: {sorted(missing)}")
+        raise UpdateError(message=f"Traffic sources {sorted(missing)} aren't found in tracker.")
+
+
 def _save_campaigns(campaigns_to_save, campaigns_db):
     """
-    Save campaigns to database (or update statistics, if campaign already exists).
+    Save campaigns to database (or update statistics, if campaign already exists) by bulk queries.
+    Offers links are added for new campaigns and for campaigns, that were changed (name, traffic group
+    or traffic source), cached routing of these campaigns is invalidated after commit.
 
     :param campaigns_to_save: campaigns to save
     :type campaigns_to_save: List[CampaignTracker]
 
-    :param campaigns_db: current campaigns from database
+    :param campaigns_db: current campaigns of user from database
     :type campaigns_db: List[Campaign]
 
     :return: None
     """
 
+    campaigns_db = {campaign_db.id: campaign_db for campaign_db in campaigns_db}
+
+    # campaign may be already saved for other user (or without user), such campaign is updated too
+    campaigns_db.update(Campaign.objects.in_bulk([campaign.id for campaign in campaigns_to_save
+                                                  if campaign.id not in campaigns_db]))
+
+    campaigns_to_create = []
+    campaigns_to_update = []
+    campaigns_to_link = []
+
+    for campaign in campaigns_to_save:
+        campaign_db = campaigns_db.get(campaign.id)
+
+        if campaign_db is None:
+            campaigns_to_create.append(campaign.to_model())
+        else:
+            campaigns_to_update.append(campaign.to_model())
+
+        if campaign_db is None or not campaign.same_as(campaign_db):
+            campaigns_to_link.append(campaign)
+
+    _check_traffic_sources({campaign.traffic_source_id for campaign in campaigns_to_save})
+    offers = _get_offers({offer_id for campaign in campaigns_to_link for offer_id in campaign.offers_list})
+    links = []
+
+    for campaign in campaigns_to_link:
+        for offer_id in campaign.offers_list:
+            if offer_id not in offers:
+                _logger.error(f"Campaign {campaign.id} has unknown offer: {offer_id}")
+                continue
+
+            links.append(Campaign.offers_list.through(campaign_id=campaign.id, offer_id=offer_id))
+
     with transaction.atomic():
-        for campaign in campaigns_to_save:
-            if campaign["instance"] not in campaigns_db:
-                campaign["instance"].save()
+        # campaigns may be inserted by concurrent calculation with the same statistics after lookup
+        Campaign.objects.bulk_create(campaigns_to_create, batch_size=1000, ignore_conflicts=True)
+        Campaign.objects.bulk_update(campaigns_to_update, ["name", "traffic_group", "traffic_source", "revenue",
+                                                           "cost", "profit", "user"], batch_size=1000)
+        Campaign.offers_list.through.objects.bulk_create(links, batch_size=1000, ignore_conflicts=True)
+
+        # bulk insert doesn't send m2m_changed, so cached routing of relinked campaigns is removed here
+        invalidate_campaigns_offers_on_commit(campaign.id for campaign in campaigns_to_link)
+
+
+def _report_progress(progress, stage, percent):
+    """
+    Pass current calculation stage to progress callback (if it's set).
+    """
+
+    if progress is not None:
+        progress(stage, percent)
 
-                for offer_id in campaign["offers_list"]:
-                    try:
-                        offer = Offer.objects.get(id=offer_id)
-                    except Offer.DoesNotExist:
-                        update_offers()
 
-                        try:
-                            offer = Offer.objects.get(id=offer_id)
-                        except Offer.DoesNotExist:
-                            _logger.error(f"Campaign {campaign['instance'].id} has unknown offer: {offer_id}")
-                            continue
+def calculate_user_salary(user, start_date, end_date, commit, traffic_groups, campaigns_list=None, tests_list=None,
+                          progress=None, profit_memo=None):
+    """
+    Calculate user salary for the period. Synchronous wrapper for calculate_user_salary_async.
+
+    :param user: user
+    :type user: User
+
+    :param start_date: period start date
+    :type start_date: date
 
-                    campaign["instance"].offers_list.add(offer)
+    :param end_date: period end date
+    :type end_date: date
+
+    :param commit: save changes to database
+    :type commit: bool
+
+    :param traffic_groups: traffic groups that includes in calculation
+    :type traffic_groups: List[str]
 
-            campaign["instance"].save()
+    :param campaigns_list: user campaigns for the period, if they are already fetched from tracker
+    :type campaigns_list: List[CampaignTracker]
 
+    :param tests_list: user active tests, if they are already loaded from database
+    :type tests_list: List[Test]
+
+    :param progress: callback, that gets stage description and progress in percents
+    :type progress: Callable[[str, int], None]
+
+    :param profit_memo: RedisClient instance of the run (e.g. batch payroll run), that keeps users profits
+        with tests, so subordinates profits are calculated once for all teamleads
+    :type profit_memo: RedisClient
+
+    :return: calculation result (context for result page)
+    :rtype: Dict[str, Any]
+    """
+
+    return async_to_sync(calculate_user_salary_async)(user, start_date, end_date, commit, traffic_groups,
+                                                      campaigns_list, tests_list, progress, profit_memo)
+
+
+async def calculate_user_salary_async(user, start_date, end_date, commit, traffic_groups, campaigns_list=None,
+                                      tests_list=None, progress=None, profit_memo=None):
+    """
+    Calculate user salary for the period. Campaigns for current period and for all previous periods (deltas)
+    are fetched from tracker concurrently, all database work runs in caller's thread.
+
+    :param user: user
+    :type user: User
+
+    :param start_date: period start date
+    :type start_date: date
+
+    :param end_date: period end date
+    :type end_date: date
+
+    :param commit: save changes to database
+    :type commit: bool
+
+    :param traffic_groups: traffic groups that includes in calculation
+    :type traffic_groups: List[str]
+
+    :param campaigns_list: user campaigns for the period, if they are already fetched from tracker
+    :type campaigns_list: List[CampaignTracker]
+
+    :param tests_list: user active tests, if they are already loaded from database
+    :type tests_list: List[Test]
+
+    :param progress: callback, that gets stage description and progress in percents
+    :type progress: Callable[[str, int], None]
+
+    :param profit_memo: RedisClient instance of the run, that keeps users profits with tests
+    :type profit_memo: RedisClient
+
+    :return: calculation result (context for result page)
+    :rtype: Dict[str, Any]
+    """
 
-def calculate_user_salary(user, start_date, end_date, commit, traffic_groups):
     report = Rp()
     report.user = user
     report.start_date = start_date
@@ -195,43 +360,109 @@ def calculate_user_salary(user, start_date, end_date, commit, traffic_groups):
 
     _logger.info("Start balances was successfully set.")
 
-    prev_campaigns_db_list = list(Campaign.objects.filter(user=user))
-    current_campaigns_tracker_list = get_campaigns(start_date, end_date, user, redis_client)
+    _report_progress(progress, "Getting campaigns from tracker", 10)
+
+    prev_campaigns_db_list = await sync_to_async(list, thread_sensitive=True)(Campaign.objects.filter(user=user))
+    if campaigns_list is None:
+        current_campaigns_tracker_list, report.deltas = await asyncio.gather(
+            async_get_info.get_campaigns(start_date, end_date, user, redis_client),
+            TrackerManager.calculate_deltas_async(user, traffic_groups, commit, redis_client),
+        )
+    else:
+        current_campaigns_tracker_list = campaigns_list
+        report.deltas = await TrackerManager.calculate_deltas_async(user, traffic_groups, commit, redis_client)
 
     _logger.info("Successfully get campaigns info (database and tracker, current and previous period).")
+    _logger.info(f"Local routing cache stats: {RedisClient.local_cache_stats()}")
 
-    report.revenues, report.profits = TrackerManager.calculate_profit_for_period(current_campaigns_tracker_list,
+    _report_progress(progress, "Calculating profits", 50)
+
+    current_campaigns_batch = CampaignBatch.from_campaigns(current_campaigns_tracker_list)
+    report.revenues, report.profits = TrackerManager.calculate_profit_for_period(current_campaigns_batch,
                                                                                  traffic_groups)
 
     _logger.info(f"Total revenue and profits was successfully calculated. "
                  f"Revenues: {report.revenues}. Profits: {report.profits}")
 
-    report.deltas = TrackerManager.calculate_deltas(user, traffic_groups, commit, redis_client)
+    redis_client.clear()
 
-    TestsManager.archive_user_tests(user)
-    tests_list = list(Test.objects.filter(user=user, archived=False).prefetch_related('offers', 'traffic_sources',
-                                                                                      'geo'))
+    return await sync_to_async(_complete_user_salary, thread_sensitive=True)(
+        report, current_campaigns_tracker_list, current_campaigns_batch, prev_campaigns_db_list, commit, tests_list,
+        progress, profit_memo
+    )
 
-    redis_client.clear()
+
+def _complete_user_salary(report, current_campaigns_tracker_list, current_campaigns_batch, prev_campaigns_db_list,
+                          commit, tests_list=None, progress=None, profit_memo=None):
+    """
+    Calculate tests, final percents and teamlead profit, generate pdf report and save results to database.
+
+    :param report: report with calculated profits and deltas
+    :type report: Rp
+
+    :param current_campaigns_tracker_list: list of user campaigns with current statistics
+    :type current_campaigns_tracker_list: List[CampaignTracker]
+
+    :param current_campaigns_batch: the same campaigns in columnar batch
+    :type current_campaigns_batch: CampaignBatch
+
+    :param prev_campaigns_db_list: current campaigns from database
+    :type prev_campaigns_db_list: List[Campaign]
+
+    :param commit: save changes to database
+    :type commit: bool
+
+    :param tests_list: user active tests, if they are already loaded from database
+    :type tests_list: List[Test]
+
+    :param progress: callback, that gets stage description and progress in percents
+    :type progress: Callable[[str, int], None]
+
+    :param profit_memo: RedisClient instance of the run, that keeps users profits with tests
+    :type profit_memo: RedisClient
+
+    :return: calculation result (context for result page)
+    :rtype: Dict[str, Any]
+    """
+
+    user = report.user
+    start_date = report.start_date
+    end_date = report.end_date
+    traffic_groups = report.traffic_groups
+
+    _report_progress(progress, "Calculating tests", 60)
+
+    if tests_list is None:
+        tests_list = TestsManager.load_active_tests([user])[user.id]
 
     report.tests = TestsManager.calculate_tests(tests_list, current_campaigns_tracker_list, commit, traffic_groups,
-                                                start_date, end_date)
+                                                start_date, end_date, current_campaigns_batch)
     _logger.info(f"Tests was successfully calculated: {report.tests}")
 
+    if profit_memo is None:
+        profit_memo = RedisClient()
+
+    profit_memo.add_profit_with_tests(user.id, start_date, end_date, traffic_groups,
+                                      TestsManager.sum_profit_with_tests(report.profits, report.tests, traffic_groups))
+
     report.final_percents = {traffic_group: _calculate_final_percent(report.revenues[traffic_group], user.salary_group)
                              for traffic_group in traffic_groups}
 
     _logger.info(f"Final percents: {report.final_percents}. User is lead: {user.is_lead}")
 
     if user.is_lead:
+        _report_progress(progress, "Calculating profit from other users", 70)
         report.from_other_users = _calculate_teamlead_profit_from_other_users(start_date, end_date, user,
-                                                                              traffic_groups)
+                                                                              traffic_groups, profit_memo)
         _logger.info(f"User profit from other users (as teamlead): {report.from_other_users}")
 
+    _report_progress(progress, "Generating report", 85)
+
     report.generate_calculation()
     report_filename = report.generate_pdf()
 
     if commit:
+        _report_progress(progress, "Saving results", 95)
         report.save()
         _save_campaigns(current_campaigns_tracker_list, prev_campaigns_db_list)
 
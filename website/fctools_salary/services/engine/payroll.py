@@ -0,0 +1,169 @@
+# Copyright © 2020-2021 Filthy Claws Tools - All Rights Reserved
+#
+# This file is part of FCTools_payroll
+#
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Author: German Yakimov <german13yakimov@gmail.com>
+
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from typing import List, Dict
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.db import connections, transaction
+
+from fctools_salary.domains.accounts.test import Test
+from fctools_salary.domains.accounts.user import User
+from fctools_salary.services.binom.async_get_info import get_campaigns_for_users
+from fctools_salary.services.binom.sync_scheduler import sync_basic_info
+from fctools_salary.services.engine.engine import calculate_user_salary
+from fctools_salary.services.engine.payroll_worker import init_worker, calculate_user_in_worker
+from fctools_salary.services.engine.tests_manager import TestsManager
+from fctools_salary.services.helpers.redis_client import RedisClient
+
+_logger = logging.getLogger(__name__)
+
+
+def calculate_user(user, start_date, end_date, commit, traffic_groups, profit_memo, campaigns_list=None,
+                   tests_list=None):
+    """
+    Calculate salary for one user of payroll run in separate transaction.
+
+    :return: calculation result or error message
+    :rtype: Dict[str, Any]
+    """
+
+    try:
+        with transaction.atomic():
+            result = calculate_user_salary(user, start_date, end_date, commit, traffic_groups,
+                                           campaigns_list=campaigns_list, tests_list=tests_list,
+                                           profit_memo=profit_memo)
+
+        return {"user": str(user), "result": result, "error": None}
+    except Exception as exception:
+        _logger.error(f"Can't calculate salary for user {user}: {exception}")
+        return {"user": str(user), "result": None, "error": str(exception)}
+
+
+def _report_users_progress(progress, done, users):
+    """
+    Pass number of calculated users to progress callback (if it's set).
+    """
+
+    if progress is not None:
+        progress(f"Calculated {done} of {len(users)} users", 10 + 90 * done // len(users))
+
+
+def _calculate_users_in_processes(users, start_date, end_date, commit, traffic_groups, workers, run_id,
+                                  progress=None):
+    """
+    Calculate salary for users using pool of worker processes.
+
+    :return: calculation result (or error message) for each user id
+    :rtype: Dict[int, Dict[str, Any]]
+    """
+
+    # forked processes must not share parent's database connections
+    connections.close_all()
+
+    results = {}
+    context = multiprocessing.get_context(settings.PAYROLL_START_METHOD)
+    databases_names = {alias: connections[alias].settings_dict["NAME"] for alias in connections}
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker,
+                             initargs=(settings.SETTINGS_MODULE, databases_names)) as executor:
+        futures = {user.id: executor.submit(calculate_user_in_worker, user.id, start_date, end_date, commit,
+                                            traffic_groups, run_id)
+                   for user in users}
+
+        for user in users:
+            try:
+                results[user.id] = futures[user.id].result()
+            except Exception as exception:
+                _logger.error(f"Payroll worker failed while calculating salary for user {user}: {exception}")
+                results[user.id] = {"user": str(user), "result": None, "error": repr(exception)}
+
+            _report_users_progress(progress, len(results), users)
+
+    return results
+
+
+def calculate_payroll(start_date, end_date, commit, traffic_groups, users=None, workers=None, progress=None):
+    """
+    Calculate salary for all active users for the period (batch payroll run). Database syncs with tracker once
+    for all users (if it's stale). If workers number is 1, campaigns of all users are fetched from tracker concurrently
+    and users are calculated one by one, else users are spread across worker processes.
+    Users profits with tests are memoized for the run, so subordinates profits are calculated once for all
+    teamleads. Error in calculation for some user doesn't stop calculation for other users.
+
+    :param start_date: period start date
+    :type start_date: date
+
+    :param end_date: period end date
+    :type end_date: date
+
+    :param commit: save changes to database
+    :type commit: bool
+
+    :param traffic_groups: traffic groups that includes in calculation
+    :type traffic_groups: List[str]
+
+    :param users: users to calculate, all active users (salary group > 0) by default
+    :type users: List[User]
+
+    :param workers: number of worker processes, settings.PAYROLL_WORKERS by default
+    :type workers: int
+
+    :param progress: callback, that gets stage description (e.g. number of calculated users) and progress in percents
+    :type progress: Callable[[str, int], None]
+
+    :return: calculation result (or error message) for each user id
+    :rtype: Dict[int, Dict[str, Any]]
+    """
+
+    _logger.info(f"Start payroll calculating from {start_date} to {end_date}")
+
+    if progress is not None:
+        progress("Updating database from tracker", 0)
+
+    sync_basic_info()
+
+    if users is None:
+        users = list(User.objects.filter(salary_group__gt=0))
+
+    if workers is None:
+        workers = settings.PAYROLL_WORKERS
+
+    redis_client = RedisClient()
+
+    if progress is not None:
+        progress("Getting campaigns and tests", 5)
+
+    if workers > 1 and len(users) > 1:
+        TestsManager.archive_expired_tests(Test.objects.filter(user__in=users, archived=False))
+
+        results = _calculate_users_in_processes(users, start_date, end_date, commit, traffic_groups,
+                                                min(workers, len(users)), redis_client.run_id, progress)
+    else:
+        campaigns = async_to_sync(get_campaigns_for_users)(start_date, end_date, users, redis_client)
+        tests = TestsManager.load_active_tests(users)
+
+        _logger.info(f"Campaigns and tests for {len(users)} users were successfully get.")
+
+        results = {}
+
+        for user in users:
+            results[user.id] = calculate_user(user, start_date, end_date, commit, traffic_groups, redis_client,
+                                              campaigns_list=campaigns[user.id], tests_list=tests[user.id])
+            _report_users_progress(progress, len(results), users)
+
+    redis_client.clear()
+
+    _logger.info(f"Payroll from {start_date} to {end_date} was calculated, "
+                 f"errors: {sum(1 for result in results.values() if result['error'])}")
+
+    return results
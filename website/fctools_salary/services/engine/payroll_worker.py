@@ -0,0 +1,55 @@
+# Copyright © 2020-2021 Filthy Claws Tools - All Rights Reserved
+#
+# This file is part of FCTools_payroll
+#
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Author: German Yakimov <german13yakimov@gmail.com>
+
+# Spawned worker process imports this module before Django is set up, so models and engine code
+# must not be imported here at module level.
+
+import os
+
+import django
+
+
+def init_worker(settings_module, databases_names):
+    """
+    Initialize payroll worker process. Django apps have to be set up, if process was spawned (not forked),
+    each worker opens its own database connection on first query.
+
+    :param settings_module: settings module of parent process
+    :type settings_module: str
+
+    :param databases_names: database name for each connection alias of parent process
+        (it may differ from settings, e.g. in tests)
+    :type databases_names: Dict[str, str]
+
+    :return: None
+    """
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", settings_module)
+    django.setup()
+
+    from django.db import connections
+
+    for alias, name in databases_names.items():
+        connections[alias].settings_dict["NAME"] = name
+
+
+def calculate_user_in_worker(user_id, start_date, end_date, commit, traffic_groups, run_id):
+    """
+    Calculate salary for one user of payroll run in worker process (whole pipeline: campaigns, deltas, tests,
+    teamlead profit and pdf report). Users profits with tests are shared between workers by run id.
+
+    :return: calculation result or error message
+    :rtype: Dict[str, Any]
+    """
+
+    from fctools_salary.domains.accounts.user import User
+    from fctools_salary.services.engine.payroll import calculate_user
+    from fctools_salary.services.helpers.redis_client import RedisClient
+
+    return calculate_user(User.objects.get(id=user_id), start_date, end_date, commit, traffic_groups,
+                          RedisClient(run_id))
@@ -9,12 +9,17 @@
 import logging
 from datetime import datetime, timedelta
 
-from django.db import transaction
+from asgiref.sync import async_to_sync
+from django.db import connection, transaction
+from django.db.models import DateField, ExpressionWrapper, F, Q
 
 from fctools_salary.domains.accounts.test import Test
 from fctools_salary.exceptions import UpdateError, TestNotSplitError
-from fctools_salary.services.binom.get_info import get_campaigns, get_campaign_main_geo
+from fctools_salary.services.binom.async_get_info import get_campaigns_for_users
+from fctools_salary.services.binom.get_info import get_campaigns, get_campaigns_main_geos
 from fctools_salary.services.engine.tracker_manager import TrackerManager
+from fctools_salary.services.helpers.campaign_batch import CampaignBatch
+from fctools_salary.services.helpers.campaign_index import CampaignIndex
 from fctools_salary.services.helpers.redis_client import RedisClient
 
 _logger = logging.getLogger(__name__)
@@ -26,7 +31,52 @@ class TestsManager:
     """
 
     @staticmethod
-    def calculate_tests(tests_list, campaigns_list, commit, traffic_groups, start_date, end_date):
+    def _get_main_geos(tests_info, campaigns_list, campaigns_index, start_date, end_date, redis):
+        """
+        Get main geo for all campaigns, that can be matched with geo-restricted tests, by one batch of requests.
+
+        :param tests_info: list of (test, offers ids, traffic sources ids, geos) for each test
+        :type tests_info: List[Tuple[Test, Set[int], List[int], List[str]]]
+
+        :param campaigns_list: list of user campaigns with current statistics
+        :type campaigns_list: List[CampaignTracker]
+
+        :param campaigns_index: index of the same campaigns (of traffic groups, that includes in calculation)
+        :type campaigns_index: CampaignIndex
+
+        :param start_date: period start date
+        :type start_date: date
+
+        :param end_date: period end date
+        :type end_date: date
+
+        :param redis: RedisClient instance for caching
+        :type redis: RedisClient
+
+        :return: main geo for each campaign id
+        :rtype: Dict[int, Union[int, str, None]]
+        """
+
+        campaigns_indexes = set()
+
+        for test, test_offers_ids, test_traffic_sources_ids, test_geos in tests_info:
+            if test_geos:
+                campaigns_indexes.update(campaigns_index.match(test_traffic_sources_ids, test_offers_ids))
+
+        campaigns_with_geo_tests = [campaigns_list[index] for index in sorted(campaigns_indexes)]
+
+        main_geos = redis.get_campaigns_main_geos([campaign.id for campaign in campaigns_with_geo_tests])
+        campaigns_to_request = [campaign for campaign in campaigns_with_geo_tests if campaign.id not in main_geos]
+
+        requested_main_geos = get_campaigns_main_geos(campaigns_to_request, start_date, end_date)
+        redis.add_campaigns_main_geos(requested_main_geos)
+        main_geos.update(requested_main_geos)
+
+        return main_geos
+
+    @staticmethod
+    def calculate_tests(tests_list, campaigns_list, commit, traffic_groups, start_date, end_date,
+                        campaigns_batch=None):
         """
         Calculates the amount that should be returned to employee (user)
         analyzing the statistics of the test campaigns for the period.
@@ -49,6 +99,9 @@ class TestsManager:
         :param end_date: period end date
         :type end_date: date
 
+        :param campaigns_batch: the same campaigns in columnar batch, if it's already built
+        :type campaigns_batch: CampaignBatch
+
         :return: amounts with detailed calculation for the period (split by traffic sources)
         :rtype: Dict[str, List[Union[str, float]]]
         """
@@ -57,55 +110,62 @@ class TestsManager:
         done_campaigns_ids = set()
         redis = RedisClient()
 
-        with transaction.atomic():
-            for test in tests_list:
-                if test.traffic_group not in traffic_groups:
-                    continue
+        tests_info = []
 
-                test_campaigns_list = []
+        for test in tests_list:
+            if test.traffic_group not in traffic_groups:
+                continue
+
+            test_offers_ids = {offer.id for offer in list(test.offers.all())}
+            test_traffic_sources_ids = [ts.id for ts in list(test.traffic_sources.all())]
+            test_geos = [geo.country for geo in list(test.geo.all())]
+
+            if len(test_traffic_sources_ids) > 1 and not test.one_budget_for_all_traffic_sources:
+                _logger.error(f"Test with id {test.id} doesn't split by traffic sources.")
+                raise TestNotSplitError(test_id=test.id)
+
+            if len(test_geos) > 1 and not test.one_budget_for_all_geo:
+                _logger.error(f"Test with id {test.id} doesn't split by geo.")
+                raise TestNotSplitError(test_id=test.id)
 
-                test_offers_ids = {offer.id for offer in list(test.offers.all())}
-                test_traffic_sources_ids = [ts.id for ts in list(test.traffic_sources.all())]
-                test_geos = [geo.country for geo in list(test.geo.all())]
+            if len(test_offers_ids) > 1 and not test.one_budget_for_all_offers:
+                _logger.error(f"Test with id {test.id} doesn't split by offers.")
+                raise TestNotSplitError(test_id=test.id)
 
-                if len(test_traffic_sources_ids) > 1 and not test.one_budget_for_all_traffic_sources:
-                    _logger.error(f"Test with id {test.id} doesn't split by traffic sources.")
-                    raise TestNotSplitError(test_id=test.id)
+            tests_info.append((test, test_offers_ids, test_traffic_sources_ids, test_geos))
 
-                if len(test_geos) > 1 and not test.one_budget_for_all_geo:
-                    _logger.error(f"Test with id {test.id} doesn't split by geo.")
-                    raise TestNotSplitError(test_id=test.id)
+        if campaigns_batch is None:
+            campaigns_batch = CampaignBatch.from_campaigns(campaigns_list)
 
-                if len(test_offers_ids) > 1 and not test.one_budget_for_all_offers:
-                    _logger.error(f"Test with id {test.id} doesn't split by offers.")
-                    raise TestNotSplitError(test_id=test.id)
+        campaigns_index = CampaignIndex(campaigns_list, campaigns_batch, traffic_groups)
+        main_geos = TestsManager._get_main_geos(tests_info, campaigns_list, campaigns_index, start_date, end_date,
+                                                redis)
+
+        changed_tests = []
+
+        with transaction.atomic():
+            for test, test_offers_ids, test_traffic_sources_ids, test_geos in tests_info:
+                test_campaigns_list = []
 
                 start_balance = test.balance
                 test_balance = test.balance
 
-                for campaign in campaigns_list:
-                    if campaign["instance"].id in done_campaigns_ids:
+                for index in campaigns_index.match(test_traffic_sources_ids, test_offers_ids):
+                    campaign = campaigns_list[index]
+
+                    if campaign.id in done_campaigns_ids:
                         continue
 
-                    if (
-                            campaign["instance"].traffic_group in traffic_groups
-                            and campaign["instance"].traffic_source.id in test_traffic_sources_ids
-                            and len(test_offers_ids & set(campaign["offers_list"])) != 0
-                    ):
-                        if test_geos:
-                            if not redis.exists(campaign["instance"].id):
-                                max_clicks_geo = get_campaign_main_geo(campaign["instance"], start_date, end_date)
-                                redis.add_campaign_main_geo(campaign["instance"].id, max_clicks_geo)
-                            else:
-                                max_clicks_geo = redis.get_campaign_main_geo(campaign["instance"].id)
-
-                            if max_clicks_geo == -1:
-                                raise UpdateError(f"Can't get campaign {campaign.id} main geo.")
-
-                            if max_clicks_geo in test_geos:
-                                test_campaigns_list.append(campaign["instance"])
-                        else:
-                            test_campaigns_list.append(campaign["instance"])
+                    if test_geos:
+                        max_clicks_geo = main_geos[campaign.id]
+
+                        if max_clicks_geo == -1:
+                            raise UpdateError(f"Can't get campaign {campaign.id} main geo.")
+
+                        if max_clicks_geo in test_geos:
+                            test_campaigns_list.append(campaign)
+                    else:
+                        test_campaigns_list.append(campaign)
 
                 for test_campaign in test_campaigns_list:
                     if test_campaign.profit >= 0:
@@ -141,11 +201,13 @@ class TestsManager:
                 if commit and (test_balance != start_balance or test_balance <= 0):
                     if test_balance > 0:
                         test.balance = test_balance
-                        test.save()
                     else:
                         test.balance = 0.0
                         test.archived = True
-                        test.save()
+
+                    changed_tests.append(test)
+
+            Test.objects.bulk_update(changed_tests, ["balance", "archived"])
 
         redis.clear()
 
@@ -179,18 +241,41 @@ class TestsManager:
         :rtype: Dict[str, float]
         """
 
-        result = {traffic_group: 0.0 for traffic_group in traffic_groups}
+        tests_list = TestsManager.load_active_tests([user], archive_expired=False)[user.id]
 
-        current_campaigns_tracker = get_campaigns(start_date, end_date, user)
+        return TestsManager._calculate_profit_with_tests(user, get_campaigns(start_date, end_date, user), tests_list,
+                                                         start_date, end_date, traffic_groups)
 
-        if not current_campaigns_tracker:
+    @staticmethod
+    def _calculate_profit_with_tests(user, campaigns_list, tests_list, start_date, end_date, traffic_groups):
+        if not campaigns_list:
             raise UpdateError(message=f"Can't get campaigns from {start_date} to {end_date} for user {user}")
 
-        profit = TrackerManager.calculate_profit_for_period(current_campaigns_tracker, traffic_groups)[1]
+        campaigns_batch = CampaignBatch.from_campaigns(campaigns_list)
+        profit = TrackerManager.calculate_profit_for_period(campaigns_batch, traffic_groups)[1]
+
+        tests = TestsManager.calculate_tests(tests_list, campaigns_list, False, traffic_groups, start_date, end_date,
+                                             campaigns_batch)
 
-        tests_list = list(Test.objects.filter(user=user, archived=False))
-        tests = TestsManager.calculate_tests(tests_list, current_campaigns_tracker, False, traffic_groups, start_date,
-                                             end_date)
+        return TestsManager.sum_profit_with_tests(profit, tests, traffic_groups)
+
+    @staticmethod
+    def sum_profit_with_tests(profit, tests, traffic_groups):
+        """
+        :param profit: profit for each traffic group
+        :type profit: Dict[str, float]
+
+        :param tests: tests amounts with detailed calculation for each traffic group
+        :type tests: Dict[str, List[Union[str, float]]]
+
+        :param traffic_groups: traffic groups to calculate
+        :type traffic_groups: List[str]
+
+        :return: profit including tests for each traffic group
+        :rtype: Dict[str, float]
+        """
+
+        result = {traffic_group: 0.0 for traffic_group in traffic_groups}
 
         for traffic_group in result:
             result[traffic_group] += profit[traffic_group] + tests[traffic_group][1]
@@ -198,12 +283,120 @@ class TestsManager:
         return result
 
     @staticmethod
-    def archive_user_tests(user):
-        tests_list = Test.objects.filter(user=user, archived=False)
+    def calculate_profits_with_tests(users, start_date, end_date, traffic_groups, memo):
+        """
+        Calculates profit for the period including tests for several users. Profits are memoized for the run,
+        so each user is calculated once, campaigns of not calculated users are fetched from tracker concurrently
+        and their tests are loaded at once.
+
+        :param users: users
+        :type users: List[User]
+
+        :param start_date: date
+        :type start_date: date
+
+        :param end_date: date
+        :type end_date: date
+
+        :param traffic_groups: traffic groups to calculate
+        :type traffic_groups: List[str]
+
+        :param memo: RedisClient instance of the run, that keeps calculated profits
+        :type memo: RedisClient
+
+        :return: profit from start_date to end_date including tests (for each traffic group) for each user id
+        :rtype: Dict[int, Dict[str, float]]
+        """
+
+        result = memo.get_profits_with_tests([user.id for user in users], start_date, end_date, traffic_groups)
+        users_to_calculate = list({user.id: user for user in users if user.id not in result}.values())
+
+        if not users_to_calculate:
+            return result
+
+        campaigns = async_to_sync(get_campaigns_for_users)(start_date, end_date, users_to_calculate, memo)
+        tests = TestsManager.load_active_tests(users_to_calculate)
+
+        for user in users_to_calculate:
+            result[user.id] = TestsManager._calculate_profit_with_tests(user, campaigns[user.id], tests[user.id],
+                                                                        start_date, end_date, traffic_groups)
+            memo.add_profit_with_tests(user.id, start_date, end_date, traffic_groups, result[user.id])
+
+        return result
+
+    @staticmethod
+    def load_active_tests(users, archive_expired=True):
+        """
+        Load active tests of several users with their offers, traffic sources and geo
+        (by one query for tests and one query for each relation, regardless of users number).
+
+        :param users: users
+        :type users: List[User]
+
+        :param archive_expired: archive expired tests of users before loading
+        :type archive_expired: bool
+
+        :return: active tests for each user id
+        :rtype: Dict[int, List[Test]]
+        """
+
+        tests_queryset = Test.objects.filter(user__in=users, archived=False)
+
+        if archive_expired:
+            TestsManager.archive_expired_tests(tests_queryset)
+
+        tests = {user.id: [] for user in users}
+
+        for test in tests_queryset.prefetch_related("offers", "traffic_sources", "geo"):
+            tests[test.user_id].append(test)
+
+        return tests
+
+    @staticmethod
+    def archive_expired_tests(tests):
+        """
+        Archive tests, whose lifetime is over (adding date + lifetime <= today). Expiration is checked by database
+        in one update query. Date arithmetic with integer lifetime is supported by PostgreSQL only, so for other
+        databases update query has date condition for each lifetime value.
+
+        :param tests: tests to check
+        :type tests: QuerySet
+
+        :return: number of archived tests
+        :rtype: int
+        """
+
         today = datetime.utcnow().date()
 
-        with transaction.atomic():
-            for test in tests_list:
-                if today - test.adding_date >= timedelta(days=test.lifetime):
-                    test.archived = True
-                    test.save()
+        if connection.vendor == "postgresql":
+            expiration_date = ExpressionWrapper(F("adding_date") + F("lifetime") * timedelta(days=1),
+                                                output_field=DateField())
+
+            return tests.annotate(expiration_date=expiration_date).filter(expiration_date__lte=today).update(
+                archived=True)
+
+        lifetimes = list(tests.order_by().values_list("lifetime", flat=True).distinct())
+
+        if not lifetimes:
+            return 0
+
+        expired = Q()
+
+        for lifetime in lifetimes:
+            expired |= Q(lifetime=lifetime, adding_date__lte=today - timedelta(days=lifetime))
+
+        return tests.filter(expired).update(archived=True)
+
+    @staticmethod
+    def archive_user_tests(user):
+        """
+        Archive user tests, whose lifetime is over.
+
+        :param user: user
+        :type user: User
+
+        :return: number of archived tests
+        :rtype: int
+        """
+
+        return TestsManager.archive_expired_tests(Test.objects.filter(user=user, archived=False))
@@ -6,12 +6,30 @@
 # Proprietary and confidential
 # Author: German Yakimov <german13yakimov@gmail.com>
 
+from datetime import datetime, timedelta
+
+from asgiref.sync import async_to_sync, sync_to_async
 from django.conf import settings
 
+from fctools_salary.exceptions import UpdateError
 from fctools_salary.models import Report
-from fctools_salary.services.binom.get_info import get_campaigns
+from fctools_salary.services.binom.async_get_info import get_campaigns_for_periods
+from fctools_salary.services.helpers.campaign_batch import CampaignBatch
+from fctools_salary.services.helpers.daily_stats import DailyStats, days_of_periods
+from fctools_salary.services.helpers.local_stats import get_local_daily_campaigns
 from fctools_salary.services.helpers.redis_client import RedisClient
 
+# report field with profit for each traffic group
+_REPORT_PROFIT_FIELDS = {
+    settings.ADMIN: "profit_admin",
+    settings.PUSH_TRAFF: "profit_push",
+    settings.POP_TRAFF: "profit_pop",
+    settings.NATIVE_TRAFF: "profit_native",
+    settings.FPA_HSA_PWA: "profit_fpa_hsa_pwa",
+    settings.INAPP_TRAFF: "profit_inapp",
+    settings.TIK_TOK: "profit_tik_tok",
+}
+
 
 class TrackerManager:
     """
@@ -22,9 +40,10 @@ class TrackerManager:
     def calculate_profit_for_period(campaigns_list, traffic_groups):
         """
         Calculates user's revenue and profit for the period without tests (just adds profit for all user campaigns).
+        Sums are calculated over columnar batch of campaigns.
 
-        :param campaigns_list: list of campaigns for period with current traffic statistics
-        :type campaigns_list: List[CampaignTracker]
+        :param campaigns_list: list (or batch) of campaigns for period with current traffic statistics
+        :type campaigns_list: Union[List[CampaignTracker], CampaignBatch]
 
         :param traffic_groups: traffic groups that includes in calculation
         :type traffic_groups: List[str]
@@ -33,17 +52,13 @@ class TrackerManager:
         :rtype: Tuple[float, Dict[str, float]]
         """
 
-        profits = {traffic_group: 0.0 for traffic_group in traffic_groups}
-        revenues = {traffic_group: 0.0 for traffic_group in traffic_groups}
-
-        for campaign in campaigns_list:
-            if campaign["instance"].traffic_group in traffic_groups:
-                profits[campaign["instance"].traffic_group] += float(campaign["instance"].profit)
-                revenues[campaign["instance"].traffic_group] += float(campaign["instance"].revenue)
+        if isinstance(campaigns_list, CampaignBatch):
+            batch = campaigns_list
+        else:
+            batch = CampaignBatch.from_campaigns(campaigns_list)
 
-        for traffic_group in traffic_groups:
-            profits[traffic_group] = round(profits[traffic_group], 6)
-            revenues[traffic_group] = round(revenues[traffic_group], 6)
+        revenues = batch.sum_by_traffic_groups(batch.revenue, traffic_groups)
+        profits = batch.sum_by_traffic_groups(batch.profit, traffic_groups)
 
         return revenues, profits
 
@@ -51,7 +66,7 @@ class TrackerManager:
     def calculate_deltas(user, traffic_groups, commit, redis=None):
         """
         Calculates deltas from previous period. Delta - a profit that relates to the previous periods,
-        but was not available at the time of calculation.
+        but was not available at the time of calculation. Synchronous wrapper for calculate_deltas_async.
 
         :param traffic_groups: traffic groups that includes in calculation
         :type traffic_groups: List[str]
@@ -65,69 +80,165 @@ class TrackerManager:
         :param redis: RedisClient instance for caching
         :type redis: RedisClient
 
-        :return: deltas for last 6 periods (split by traffic groups)
+        :return: deltas for previous periods (split by traffic groups)
         :rtype: Dict[str, List[Union[str, float]]]
         """
 
-        deltas = {traffic_group: {} for traffic_group in traffic_groups}
+        return async_to_sync(TrackerManager.calculate_deltas_async)(user, traffic_groups, commit, redis)
+
+    @staticmethod
+    async def calculate_deltas_async(user, traffic_groups, commit, redis=None):
+        """
+        Calculates deltas from previous period. Only open periods are checked: reports in look-back window
+        (settings.DELTAS_LOOKBACK_DAYS), that aren't settled yet. Campaigns for these periods are fetched
+        from tracker concurrently (or from local daily statistics, see settings.CAMPAIGNS_SOURCE), or all periods
+        are summed from local daily statistics loaded by one query (see settings.DELTAS_FETCH_MODE).
+        If campaigns for some period can't be get, UpdateError is raised (reports aren't changed).
+
+        :param traffic_groups: traffic groups that includes in calculation
+        :type traffic_groups: List[str]
+
+        :param user: user
+        :type user: User
+
+        :param commit: save changes to database
+        :type commit: bool
+
+        :param redis: RedisClient instance for caching
+        :type redis: RedisClient
 
-        reports_list = Report.objects.filter(user=user)
+        :return: deltas for previous periods (split by traffic groups)
+        :rtype: Dict[str, List[Union[str, float]]]
+        """
 
-        if not redis:
+        own_redis = redis is None
+
+        if own_redis:
             redis = RedisClient()
 
-        for report in reports_list:
+        reports_list = await sync_to_async(TrackerManager._get_open_reports, thread_sensitive=True)(user)
+        periods = [(report.start_date, report.end_date) for report in reports_list]
+
+        if settings.DELTAS_FETCH_MODE == "days":
+            campaigns_list = await sync_to_async(TrackerManager._get_campaigns_for_periods_by_days,
+                                                 thread_sensitive=True)(periods, user)
+        else:
+            campaigns_list = await get_campaigns_for_periods(periods, user, redis, with_offers=False,
+                                                             raise_on_error=True)
+
+        deltas = await sync_to_async(TrackerManager._calculate_deltas_for_reports, thread_sensitive=True)(
+            reports_list, campaigns_list, traffic_groups, commit
+        )
+
+        if own_redis:
+            redis.clear()
+
+        return deltas
+
+    @staticmethod
+    def _get_campaigns_for_periods_by_days(periods, user):
+        """
+        Load campaigns statistics for each day of periods from local daily statistics by one query
+        and sum them for each period. Missing day isn't treated as day without statistics.
+
+        :param periods: list of (start date, end date) pairs
+        :type periods: List[Tuple[date, date]]
+
+        :param user: user
+        :type user: User
+
+        :return: list of campaigns (without routing) for each period (in periods order)
+        :rtype: List[List[CampaignRecord]]
+        """
+
+        days = days_of_periods(periods)
+        daily_stats = DailyStats(get_local_daily_campaigns(days, user))
+        missing_days = daily_stats.missing_days(days)
+
+        if missing_days:
+            raise UpdateError(message=f"Daily statistics of user {user} aren't synced for {len(missing_days)} days "
+                                      f"(from {missing_days[0]} to {missing_days[-1]}).")
+
+        return [daily_stats.campaigns_for_period(start_date, end_date) for start_date, end_date in periods]
+
+    @staticmethod
+    def _get_open_reports(user):
+        """
+        :param user: user
+        :type user: User
+
+        :return: user reports, that can still change: not settled and in look-back window
+        :rtype: List[Report]
+        """
+
+        reports = Report.objects.filter(user=user, settled=False)
+
+        if settings.DELTAS_LOOKBACK_DAYS is not None:
+            reports = reports.filter(
+                end_date__gte=datetime.utcnow().date() - timedelta(days=settings.DELTAS_LOOKBACK_DAYS)
+            )
+
+        return list(reports)
+
+    @staticmethod
+    def _calculate_deltas_for_reports(reports_list, campaigns_list, traffic_groups, commit):
+        """
+        Calculates deltas for previous periods based on fetched campaigns. If commit is set, reports profits
+        and settle counters are saved by one bulk update. Report is settled after settings.DELTAS_SETTLE_CHECKS
+        checks in a row without profit changes (only checks with all traffic groups are counted), if its period
+        ended at least settings.DELTAS_SETTLE_MIN_AGE_DAYS days ago (late conversions can't change it anymore).
+
+        :param reports_list: reports for previous periods
+        :type reports_list: List[Report]
+
+        :param campaigns_list: list of campaigns from tracker for each report
+        :type campaigns_list: List[List[CampaignTracker]]
+
+        :param traffic_groups: traffic groups that includes in calculation
+        :type traffic_groups: List[str]
+
+        :param commit: save changes to database
+        :type commit: bool
+
+        :return: deltas for previous periods (split by traffic groups)
+        :rtype: Dict[str, List[Union[str, float]]]
+        """
+
+        deltas = {traffic_group: {} for traffic_group in traffic_groups}
+        fields = [_REPORT_PROFIT_FIELDS[traffic_group] for traffic_group in traffic_groups]
+        all_traffic_groups = {traffic_group for traffic_group, _ in settings.TRAFFIC_GROUPS} <= set(traffic_groups)
+        settle_end_date = datetime.utcnow().date() - timedelta(days=settings.DELTAS_SETTLE_MIN_AGE_DAYS)
+        reports_to_update = []
+
+        for report, campaigns in zip(reports_list, campaigns_list):
             key = f'{report.start_date} - {report.end_date}'
-            campaigns = get_campaigns(report.start_date, report.end_date, user, redis)
             profits = TrackerManager.calculate_profit_for_period(campaigns, traffic_groups)[1]
+            changed = False
+
+            for traffic_group in traffic_groups:
+                report_profit = getattr(report, _REPORT_PROFIT_FIELDS[traffic_group])
+
+                if report_profit is None or float(report_profit) != profits[traffic_group]:
+                    changed = True
+
+                if report_profit and float(report_profit) < profits[traffic_group]:
+                    deltas[traffic_group][key] = profits[traffic_group] - float(report_profit)
+
+            if commit and (changed or all_traffic_groups):
+                for traffic_group in traffic_groups:
+                    setattr(report, _REPORT_PROFIT_FIELDS[traffic_group], profits[traffic_group])
+
+                if changed:
+                    report.unchanged_checks = 0
+                else:
+                    report.unchanged_checks += 1
+                    report.settled = (report.unchanged_checks >= settings.DELTAS_SETTLE_CHECKS
+                                      and report.end_date <= settle_end_date)
+
+                reports_to_update.append(report)
 
-            if settings.ADMIN in traffic_groups and report.profit_admin:
-                if float(report.profit_admin) < profits[settings.ADMIN]:
-                    deltas[settings.ADMIN][key] = profits[settings.ADMIN] - float(report.profit_admin)
-
-            if settings.PUSH_TRAFF in traffic_groups and report.profit_push:
-                if float(report.profit_push) < profits[settings.PUSH_TRAFF]:
-                    deltas[settings.PUSH_TRAFF][key] = profits[settings.PUSH_TRAFF] - float(report.profit_push)
-
-            if settings.POP_TRAFF in traffic_groups and report.profit_pop:
-                if float(report.profit_pop) < profits[settings.POP_TRAFF]:
-                    deltas[settings.POP_TRAFF][key] = profits[settings.POP_TRAFF] - float(report.profit_pop)
-
-            if settings.NATIVE_TRAFF in traffic_groups and report.profit_native:
-                if float(report.profit_native) < profits[settings.NATIVE_TRAFF]:
-                    deltas[settings.NATIVE_TRAFF][key] = profits[settings.NATIVE_TRAFF] - float(report.profit_native)
-
-            if settings.FPA_HSA_PWA in traffic_groups and report.profit_fpa_hsa_pwa:
-                if float(report.profit_fpa_hsa_pwa) < profits[settings.FPA_HSA_PWA]:
-                    deltas[settings.FPA_HSA_PWA][key] = profits[settings.FPA_HSA_PWA] - float(report.profit_fpa_hsa_pwa)
-
-            if settings.INAPP_TRAFF in traffic_groups and report.profit_inapp:
-                if float(report.profit_inapp) < profits[settings.INAPP_TRAFF]:
-                    deltas[settings.INAPP_TRAFF][key] = profits[settings.INAPP_TRAFF] - float(report.profit_inapp)
-
-            if settings.TIK_TOK in traffic_groups and report.profit_tik_tok:
-                if float(report.profit_tik_tok) < profits[settings.TIK_TOK]:
-                    deltas[settings.TIK_TOK][key] = profits[settings.TIK_TOK] - float(report.profit_tik_tok)
-
-            if commit:
-                if settings.INAPP_TRAFF in traffic_groups:
-                    report.profit_inapp = profits[settings.INAPP_TRAFF]
-                if settings.FPA_HSA_PWA in traffic_groups:
-                    report.profit_fpa_hsa_pwa = profits[settings.FPA_HSA_PWA]
-                if settings.NATIVE_TRAFF in traffic_groups:
-                    report.profit_native = profits[settings.NATIVE_TRAFF]
-                if settings.POP_TRAFF in traffic_groups:
-                    report.profit_pop = profits[settings.POP_TRAFF]
-                if settings.ADMIN in traffic_groups:
-                    report.profit_admin = profits[settings.ADMIN]
-                if settings.PUSH_TRAFF in traffic_groups:
-                    report.profit_push = profits[settings.PUSH_TRAFF]
-                if settings.TIK_TOK in traffic_groups:
-                    report.profit_tik_tok = profits[settings.TIK_TOK]
-
-                report.save()
-
-        redis.clear()
+        if reports_to_update:
+            Report.objects.bulk_update(reports_to_update, fields + ["unchanged_checks", "settled"])
 
         for traffic_group in deltas:
             for key in deltas[traffic_group]:
@@ -0,0 +1,173 @@
+# Copyright © 2020-2021 Filthy Claws Tools - All Rights Reserved
+#
+# This file is part of FCTools_payroll
+#
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Author: German Yakimov <german13yakimov@gmail.com>
+
+import numpy as np
+
+# money columns are stored as fixed-point integers with 6 decimal places (as money fields of models)
+MONEY_SCALE = 10 ** 6
+
+
+def _to_fixed(values):
+    """
+    :param values: money values (decimal strings from tracker response or Decimal)
+    :type values: List[Union[str, Decimal]]
+
+    :return: fixed-point column (in millionths)
+    :rtype: np.ndarray
+    """
+
+    return np.rint(np.asarray(values, dtype=np.float64) * MONEY_SCALE).astype(np.int64)
+
+
+class CampaignBatch:
+    """
+    Columnar representation of campaigns from tracker for vectorized aggregation: int64 ids and traffic sources ids,
+    traffic groups as categorical codes (indexes in traffic_groups tuple) and money as fixed-point int64 columns
+    (in millionths), so sums are exact and don't depend on campaigns order.
+    Rows are in the same order as campaigns in source list.
+    """
+
+    __slots__ = ("ids", "traffic_groups", "group_codes", "traffic_source_ids", "revenue", "profit")
+
+    def __init__(self, ids, traffic_groups, group_codes, traffic_source_ids, revenue, profit):
+        self.ids = ids
+        self.traffic_groups = traffic_groups
+        self.group_codes = group_codes
+        self.traffic_source_ids = traffic_source_ids
+        self.revenue = revenue
+        self.profit = profit
+
+    @classmethod
+    def from_columns(cls, ids, traffic_groups, traffic_source_ids, revenue, profit):
+        """
+        Build batch from columns, that are filled while tracker response (or database rows) is parsed,
+        each column is converted by one numpy call.
+
+        :param ids: campaigns ids
+        :type ids: List[int]
+
+        :param traffic_groups: campaigns traffic groups
+        :type traffic_groups: List[str]
+
+        :param traffic_source_ids: campaigns traffic sources ids
+        :type traffic_source_ids: List[int]
+
+        :param revenue: campaigns revenues
+        :type revenue: List[Union[str, Decimal]]
+
+        :param profit: campaigns profits
+        :type profit: List[Union[str, Decimal]]
+
+        :return: batch
+        :rtype: CampaignBatch
+        """
+
+        groups, group_codes = np.unique(np.asarray(traffic_groups, dtype=str), return_inverse=True)
+
+        return cls(
+            ids=np.asarray(ids, dtype=np.int64),
+            traffic_groups=tuple(groups.tolist()),
+            group_codes=group_codes.astype(np.int16).reshape(len(ids)),
+            traffic_source_ids=np.asarray(traffic_source_ids, dtype=np.int64),
+            revenue=_to_fixed(revenue),
+            profit=_to_fixed(profit),
+        )
+
+    @classmethod
+    def from_campaigns(cls, campaigns_list):
+        """
+        :param campaigns_list: list of campaigns with statistics (batch, that was built while list was parsed,
+            is reused)
+        :type campaigns_list: Union[CampaignList, List[CampaignTracker]]
+
+        :return: batch with the same campaigns
+        :rtype: CampaignBatch
+        """
+
+        if isinstance(campaigns_list, CampaignList):
+            return campaigns_list.batch
+
+        return cls.from_columns(
+            [campaign.id for campaign in campaigns_list],
+            [campaign.traffic_group for campaign in campaigns_list],
+            [campaign.traffic_source_id for campaign in campaigns_list],
+            [campaign.revenue for campaign in campaigns_list],
+            [campaign.profit for campaign in campaigns_list],
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _codes(self, traffic_groups):
+        return [code for code, traffic_group in enumerate(self.traffic_groups) if traffic_group in traffic_groups]
+
+    def sum_by_traffic_groups(self, column, traffic_groups):
+        """
+        Sum money column by traffic groups.
+
+        :param column: money column (revenue or profit)
+        :type column: np.ndarray
+
+        :param traffic_groups: traffic groups to sum
+        :type traffic_groups: List[str]
+
+        :return: sum for each traffic group (0.0 for traffic groups without campaigns)
+        :rtype: Dict[str, float]
+        """
+
+        # float64 sums of millionths are exact up to 2 ** 53
+        sums = np.bincount(self.group_codes, weights=column, minlength=len(self.traffic_groups))
+
+        result = {traffic_group: 0.0 for traffic_group in traffic_groups}
+
+        for code in self._codes(traffic_groups):
+            result[self.traffic_groups[code]] = round(float(sums[code]) / MONEY_SCALE, 6)
+
+        return result
+
+    def select(self, traffic_groups, traffic_sources_ids=None):
+        """
+        Find campaigns of traffic groups (and traffic sources).
+
+        :param traffic_groups: traffic groups
+        :type traffic_groups: List[str]
+
+        :param traffic_sources_ids: traffic sources ids (all traffic sources, if it's None)
+        :type traffic_sources_ids: Iterable[int]
+
+        :return: indexes of found campaigns in ascending order
+        :rtype: np.ndarray
+        """
+
+        mask = np.isin(self.group_codes, self._codes(traffic_groups))
+
+        if traffic_sources_ids is not None:
+            mask &= np.isin(self.traffic_source_ids, np.fromiter(traffic_sources_ids, dtype=np.int64))
+
+        return np.flatnonzero(mask)
+
+
+class CampaignList(list):
+    """
+    List of campaigns with their columnar batch, that was filled while campaigns were parsed.
+    List mustn't be changed in place (batch rows are in the same order as campaigns).
+    """
+
+    __slots__ = ("batch",)
+
+    def __init__(self, campaigns, batch):
+        """
+        :param campaigns: campaigns with statistics
+        :type campaigns: List[CampaignTracker]
+
+        :param batch: the same campaigns in columnar batch
+        :type batch: CampaignBatch
+        """
+
+        super().__init__(campaigns)
+        self.batch = batch
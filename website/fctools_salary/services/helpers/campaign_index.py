@@ -0,0 +1,63 @@
+# Copyright © 2020-2021 Filthy Claws Tools - All Rights Reserved
+#
+# This file is part of FCTools_payroll
+#
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Author: German Yakimov <german13yakimov@gmail.com>
+
+from collections import defaultdict
+from itertools import chain
+
+
+class CampaignIndex:
+    """
+    Index of campaigns by (traffic source id, offer id) pairs from their routing for matching campaigns with tests:
+    test looks up only its own pairs, so matching cost depends on number of matched campaigns, not on number
+    of all campaigns. Campaigns are represented by indexes in source list.
+    """
+
+    __slots__ = ("_campaigns",)
+
+    def __init__(self, campaigns_list, campaigns_batch, traffic_groups):
+        """
+        :param campaigns_list: list of campaigns with statistics and routing
+        :type campaigns_list: List[CampaignTracker]
+
+        :param campaigns_batch: the same campaigns in columnar batch
+        :type campaigns_batch: CampaignBatch
+
+        :param traffic_groups: traffic groups of indexed campaigns
+        :type traffic_groups: List[str]
+        """
+
+        self._campaigns = defaultdict(list)
+
+        for index in campaigns_batch.select(traffic_groups).tolist():
+            campaign = campaigns_list[index]
+
+            for offer_id in set(campaign.offers_list):
+                self._campaigns[(campaign.traffic_source_id, offer_id)].append(index)
+
+    def match(self, traffic_sources_ids, offers_ids):
+        """
+        Find campaigns of any of traffic sources with any of offers in routing.
+
+        :param traffic_sources_ids: traffic sources ids
+        :type traffic_sources_ids: Iterable[int]
+
+        :param offers_ids: offers ids
+        :type offers_ids: Iterable[int]
+
+        :return: indexes of found campaigns in ascending order (order of source list)
+        :rtype: List[int]
+        """
+
+        found = [self._campaigns[key] for key in ((traffic_source_id, offer_id)
+                                                  for traffic_source_id in traffic_sources_ids
+                                                  for offer_id in offers_ids) if key in self._campaigns]
+
+        if len(found) == 1:
+            return found[0]
+
+        return sorted(set(chain.from_iterable(found)))
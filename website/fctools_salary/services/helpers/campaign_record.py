@@ -0,0 +1,74 @@
+# Copyright © 2020-2021 Filthy Claws Tools - All Rights Reserved
+#
+# This file is part of FCTools_payroll
+#
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Author: German Yakimov <german13yakimov@gmail.com>
+
+from fctools_salary.domains.tracker.campaign import Campaign
+
+
+class CampaignRecord:
+    """
+    Campaign from tracker with statistics for some period and its routing (offers ids).
+    Lightweight replacement of unsaved Campaign model for calculations, it becomes model only
+    when campaign is saved to database (to_model()).
+    """
+
+    __slots__ = ("id", "name", "traffic_group", "traffic_source_id", "revenue", "cost", "profit", "user_id",
+                 "offers_list", "clicks")
+
+    def __init__(self, id, name, traffic_group, traffic_source_id, revenue, cost, profit, user_id, offers_list=(),
+                 clicks=0):
+        self.id = id
+        self.name = name
+        self.traffic_group = traffic_group
+        self.traffic_source_id = traffic_source_id
+        self.revenue = revenue
+        self.cost = cost
+        self.profit = profit
+        self.user_id = user_id
+        self.offers_list = offers_list
+        self.clicks = clicks
+
+    def same_as(self, campaign):
+        """
+        :param campaign: campaign from database
+        :type campaign: Campaign
+
+        :return: True, if campaign from database has the same id, name, traffic group and traffic source
+        :rtype: bool
+        """
+
+        return all(
+            [
+                self.id == campaign.id,
+                self.name == campaign.name,
+                self.traffic_group == campaign.traffic_group,
+                self.traffic_source_id == campaign.traffic_source_id,
+            ]
+        )
+
+    def to_model(self):
+        """
+        :return: Campaign model instance with the same fields (without offers)
+        :rtype: Campaign
+        """
+
+        return Campaign(
+            id=self.id,
+            name=self.name,
+            traffic_group=self.traffic_group,
+            traffic_source_id=self.traffic_source_id,
+            revenue=self.revenue,
+            cost=self.cost,
+            profit=self.profit,
+            user_id=self.user_id,
+        )
+
+    def __str__(self):
+        return f"{self.id} {self.name}"
+
+    def __repr__(self):
+        return f"CampaignRecord(id={self.id}, name={self.name!r}, traffic_group={self.traffic_group!r})"
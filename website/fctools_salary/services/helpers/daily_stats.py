@@ -0,0 +1,100 @@
+# Copyright © 2020-2021 Filthy Claws Tools - All Rights Reserved
+#
+# This file is part of FCTools_payroll
+#
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Author: German Yakimov <german13yakimov@gmail.com>
+
+from datetime import timedelta
+
+from fctools_salary.services.helpers.campaign_record import CampaignRecord
+
+
+def days_of_periods(periods):
+    """
+    :param periods: list of (start date, end date) pairs
+    :type periods: List[Tuple[date, date]]
+
+    :return: sorted days, that are covered by at least one period
+    :rtype: List[date]
+    """
+
+    days = set()
+
+    for start_date, end_date in periods:
+        days.update(start_date + timedelta(days=offset) for offset in range((end_date - start_date).days + 1))
+
+    return sorted(days)
+
+
+
+class DailyStats:
+    """
+    Campaigns statistics matrix (campaign x day). Statistics for any period inside loaded days
+    is derived locally by summing day buckets.
+    """
+
+    def __init__(self, days_campaigns):
+        """
+        :param days_campaigns: list of campaigns with statistics for each day
+        :type days_campaigns: Dict[date, List[CampaignRecord]]
+        """
+
+        self._days_campaigns = days_campaigns
+
+    def missing_days(self, days):
+        """
+        :param days: days
+        :type days: Iterable[date]
+
+        :return: days without statistics
+        :rtype: List[date]
+        """
+
+        return [day for day in days if day not in self._days_campaigns]
+
+    def campaigns_for_period(self, start_date, end_date):
+        """
+        :param start_date: period start date
+        :type start_date: date
+
+        :param end_date: period end date
+        :type end_date: date
+
+        :return: list of campaigns with statistics summed for the period (without routing) ordered by id,
+            name, traffic group and traffic source are taken from the last day of the period
+        :rtype: List[CampaignRecord]
+        """
+
+        result = {}
+
+        for day in days_of_periods([(start_date, end_date)]):
+            if day not in self._days_campaigns:
+                raise KeyError(f"There is no statistics for {day}")
+
+            for campaign in self._days_campaigns[day]:
+                period_campaign = result.get(campaign.id)
+
+                if period_campaign is None:
+                    result[campaign.id] = CampaignRecord(
+                        id=campaign.id,
+                        name=campaign.name,
+                        traffic_group=campaign.traffic_group,
+                        traffic_source_id=campaign.traffic_source_id,
+                        revenue=campaign.revenue,
+                        cost=campaign.cost,
+                        profit=campaign.profit,
+                        user_id=campaign.user_id,
+                        clicks=campaign.clicks,
+                    )
+                else:
+                    period_campaign.name = campaign.name
+                    period_campaign.traffic_group = campaign.traffic_group
+                    period_campaign.traffic_source_id = campaign.traffic_source_id
+                    period_campaign.revenue += campaign.revenue
+                    period_campaign.cost += campaign.cost
+                    period_campaign.profit += campaign.profit
+                    period_campaign.clicks += campaign.clicks
+
+        return [result[campaign_id] for campaign_id in sorted(result)]
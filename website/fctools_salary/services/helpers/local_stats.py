@@ -0,0 +1,122 @@
+# Copyright © 2020-2021 Filthy Claws Tools - All Rights Reserved
+#
+# This file is part of FCTools_payroll
+#
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Author: German Yakimov <german13yakimov@gmail.com>
+
+from django.db.models import Count, OuterRef, Subquery, Sum
+
+from fctools_salary.domains.tracker.campaign_daily_stat import CampaignDailyStat
+from fctools_salary.services.helpers.campaign_record import CampaignRecord
+
+
+def get_local_campaigns(start_date, end_date, user):
+    """
+    Get user campaigns statistics for the period from local daily statistics (sums are calculated by database).
+    Name, traffic group and traffic source of campaign are taken from the last day of the period, when campaign
+    has statistics (as tracker returns current ones).
+
+    :param start_date: period start date
+    :type start_date: date
+
+    :param end_date: period end date
+    :type end_date: date
+
+    :param user: user
+    :type user: User
+
+    :return: list of campaigns (without routing) ordered by id, None if some day of the period isn't synced
+    :rtype: Optional[List[CampaignRecord]]
+    """
+
+    period_stats = CampaignDailyStat.objects.filter(user_id=user.id, day__range=(start_date, end_date))
+
+    # tracker returns all user campaigns (with zero statistics too) for each day, so every synced day has rows
+    synced_days = period_stats.aggregate(synced_days=Count("day", distinct=True))["synced_days"]
+
+    if synced_days < (end_date - start_date).days + 1:
+        return None
+
+    last_day_stats = CampaignDailyStat.objects.filter(
+        user_id=user.id, campaign_id=OuterRef("campaign_id"), day__range=(start_date, end_date)
+    ).order_by("-day")
+
+    campaigns_stats = (
+        period_stats
+        .values("campaign_id")
+        .annotate(
+            campaign_name=Subquery(last_day_stats.values("name")[:1]),
+            campaign_traffic_group=Subquery(last_day_stats.values("traffic_group")[:1]),
+            campaign_traffic_source_id=Subquery(last_day_stats.values("traffic_source_id")[:1]),
+            total_revenue=Sum("revenue"),
+            total_cost=Sum("cost"),
+            total_profit=Sum("profit"),
+            total_clicks=Sum("clicks"),
+        )
+        .order_by("campaign_id")
+    )
+
+    return [
+        CampaignRecord(
+            id=campaign["campaign_id"],
+            name=campaign["campaign_name"],
+            traffic_group=campaign["campaign_traffic_group"],
+            traffic_source_id=campaign["campaign_traffic_source_id"],
+            revenue=campaign["total_revenue"],
+            cost=campaign["total_cost"],
+            profit=campaign["total_profit"],
+            user_id=user.id,
+            clicks=campaign["total_clicks"],
+        )
+        for campaign in campaigns_stats
+    ]
+
+
+def get_local_daily_campaigns(days, user):
+    """
+    Get user campaigns statistics for each day from local daily statistics by one query.
+
+    :param days: days
+    :type days: List[date]
+
+    :param user: user
+    :type user: User
+
+    :return: list of campaigns (without routing) ordered by id for each day, that is synced
+    :rtype: Dict[date, List[CampaignRecord]]
+    """
+
+    if not days:
+        return {}
+
+    days_set = set(days)
+    days_campaigns = {}
+
+    daily_stats = (
+        CampaignDailyStat.objects.filter(user_id=user.id, day__range=(min(days), max(days)))
+        .order_by("day", "campaign_id")
+        .values_list("campaign_id", "name", "traffic_group", "traffic_source_id", "day", "revenue", "cost", "profit",
+                     "clicks")
+    )
+
+    for campaign_id, name, traffic_group, traffic_source_id, day, revenue, cost, profit, clicks in daily_stats:
+        if day not in days_set:
+            continue
+
+        days_campaigns.setdefault(day, []).append(
+            CampaignRecord(
+                id=campaign_id,
+                name=name,
+                traffic_group=traffic_group,
+                traffic_source_id=traffic_source_id,
+                revenue=revenue,
+                cost=cost,
+                profit=profit,
+                user_id=user.id,
+                clicks=clicks,
+            )
+        )
+
+    return days_campaigns
@@ -0,0 +1,114 @@
+"""
+Copyright © 2020-2021 FC Tools.
+All rights reserved.
+Author: German Yakimov
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Thread-safe in-process cache with size limit (least recently used entries are evicted first)
+    and entries lifetime. Counts hits, misses, evictions and expirations, so cache can be sized by its stats.
+    """
+
+    def __init__(self, max_size, ttl):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _get(self, key, now):
+        entry = self._data.get(key)
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, value = entry
+
+        if expires_at <= now:
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(key)
+        self.hits += 1
+
+        return value
+
+    def get(self, key):
+        """
+        :return: cached value or None, if there is no such key (or entry is expired)
+        """
+
+        with self._lock:
+            return self._get(key, time.monotonic())
+
+    def get_many(self, keys):
+        """
+        :return: cached values for found keys
+        :rtype: Dict
+        """
+
+        result = {}
+
+        with self._lock:
+            now = time.monotonic()
+
+            for key in keys:
+                value = self._get(key, now)
+
+                if value is not None:
+                    result[key] = value
+
+        return result
+
+    def set(self, key, value):
+        self.set_many({key: value})
+
+    def set_many(self, values):
+        with self._lock:
+            expires_at = time.monotonic() + self._ttl
+
+            for key, value in values.items():
+                self._data[key] = (expires_at, value)
+                self._data.move_to_end(key)
+
+            while len(self._data) > self._max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """
+        :return: cache counters and current size
+        :rtype: Dict[str, int]
+        """
+
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "max_size": self._max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
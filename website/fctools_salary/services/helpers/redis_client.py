@@ -5,46 +5,409 @@ Author: German Yakimov
 """
 
 import json
+import logging
+import os
+import threading
+from uuid import uuid4
 
 import redis
 from django.conf import settings
+from django.db import transaction
+
+from fctools_salary.services.helpers.lru_cache import LRUCache
+
+_logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+_offers_local_cache = None
+_offers_local_cache_lock = threading.Lock()
+
+
+def _get_connection_pool():
+    """
+    Get process-wide redis connection pool. Pool is created again after fork (e.g. in uWSGI workers).
+    """
+
+    global _pool, _pool_pid
+
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = redis.BlockingConnectionPool(host=settings.REDIS_HOST, port=settings.REDIS_PORT,
+                                                 max_connections=settings.REDIS_MAX_CONNECTIONS)
+            _pool_pid = os.getpid()
+
+    return _pool
+
+
+def _get_offers_local_cache():
+    """
+    Get in-process cache for campaigns routing (first tier before redis).
+    """
+
+    global _offers_local_cache
+
+    with _offers_local_cache_lock:
+        if _offers_local_cache is None:
+            _offers_local_cache = LRUCache(settings.LOCAL_CACHE_MAX_SIZE, settings.LOCAL_CACHE_TTL)
+
+    return _offers_local_cache
+
+
+def invalidate_campaigns_offers_on_commit(campaigns_ids):
+    """
+    Remove cached routing for campaigns (in-process and redis) after current transaction commit.
+
+    :param campaigns_ids: campaigns ids
+    :type campaigns_ids: Iterable[int]
+
+    :return: None
+    """
+
+    campaigns_ids = list(campaigns_ids)
+
+    def invalidate():
+        try:
+            RedisClient().invalidate_campaigns_offers(campaigns_ids)
+        except redis.RedisError as error:
+            _logger.error(f"Can't invalidate cached routing for campaigns {campaigns_ids}: {error}")
+
+    if campaigns_ids:
+        transaction.on_commit(invalidate)
 
 
 class RedisClient:
-    def __init__(self):
-        self._server = redis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT)
+    """
+    Cache for tracker info. All keys start with settings.REDIS_KEY_PREFIX and are split by data kind:
+    campaigns routing (offers ids) is shared between calculations and stored with TTL (settings.ROUTING_CACHE_TTL),
+    campaigns main geo and users profits with tests depend on period, so they are stored in namespace of current
+    calculation (run) and removed by clear(). Client never touches keys of other calculations, so many workers
+    can use it at once (workers of one run share it by run_id).
+    Campaigns routing is also kept in in-process LRU cache (settings.LOCAL_CACHE_MAX_SIZE entries,
+    settings.LOCAL_CACHE_TTL seconds), that is checked before redis.
+    """
+
+    def __init__(self, run_id=None):
+        self._server = redis.Redis(connection_pool=_get_connection_pool())
+        self.run_id = run_id or uuid4().hex
+        # run info is removed on deletion only by client, that started the run
+        self._owns_run = run_id is None
+        self._profits = {}
+
+    def _offers_key(self, campaign_id):
+        return f'{settings.REDIS_KEY_PREFIX}:routing:offers:{campaign_id}'
+
+    def _main_geo_key(self):
+        return f'{settings.REDIS_KEY_PREFIX}:run:{self.run_id}:geo'
+
+    def _profit_key(self):
+        return f'{settings.REDIS_KEY_PREFIX}:run:{self.run_id}:profit'
+
+    @staticmethod
+    def _profit_field(user_id, start_date, end_date, traffic_groups):
+        return f'{user_id}:{start_date}:{end_date}:{",".join(sorted(traffic_groups))}'
+
+    def get_profits_with_tests(self, users_ids, start_date, end_date, traffic_groups):
+        """
+        Get memoized users profits with tests for the period (from client memo or from redis by one round-trip).
+
+        :param users_ids: users ids
+        :type users_ids: List[int]
+
+        :param start_date: period start date
+        :type start_date: date
+
+        :param end_date: period end date
+        :type end_date: date
+
+        :param traffic_groups: traffic groups of calculation
+        :type traffic_groups: List[str]
+
+        :return: profit with tests (for each traffic group) for each user id, that has memoized profit
+        :rtype: Dict[int, Dict[str, float]]
+        """
+
+        fields = {user_id: self._profit_field(user_id, start_date, end_date, traffic_groups) for user_id in users_ids}
+        result = {user_id: self._profits[field] for user_id, field in fields.items() if field in self._profits}
+        users_ids = [user_id for user_id in fields if user_id not in result]
+
+        if not users_ids:
+            return result
+
+        values = self._server.hmget(self._profit_key(), [fields[user_id] for user_id in users_ids])
+
+        for user_id, value in zip(users_ids, values):
+            if value is not None:
+                result[user_id] = self._profits[fields[user_id]] = json.loads(value)
+
+        return result
+
+    def add_profit_with_tests(self, user_id, start_date, end_date, traffic_groups, profit):
+        """
+        Memoize user profit with tests for the period. Profit, that was memoized earlier in this run, is kept.
+
+        :param profit: profit with tests for each traffic group
+        :type profit: Dict[str, float]
+        """
+
+        field = self._profit_field(user_id, start_date, end_date, traffic_groups)
+        key = self._profit_key()
+        self._profits.setdefault(field, profit)
+
+        with self._server.pipeline() as pipeline:
+            pipeline.hsetnx(key, field, json.dumps(profit))
+            pipeline.expire(key, settings.RUN_CACHE_TTL)
+            pipeline.execute()
 
     def add_campaign_main_geo(self, campaign_id, main_geo):
-        campaign_id = str(campaign_id)
-        if not self._server.exists(campaign_id):
-            self._server.append(str(campaign_id), json.dumps({'geo': main_geo}))
+        self.add_campaigns_main_geos({campaign_id: main_geo})
+
+    def add_campaigns_main_geos(self, main_geos):
+        """
+        Save main geo for several campaigns by one round-trip.
+
+        :param main_geos: main geo for each campaign id
+        :type main_geos: Dict[int, Union[int, str, None]]
+        """
+
+        if not main_geos:
+            return
+
+        key = self._main_geo_key()
+
+        with self._server.pipeline() as pipeline:
+            for campaign_id, main_geo in main_geos.items():
+                pipeline.hsetnx(key, str(campaign_id), json.dumps({'geo': main_geo}))
+
+            pipeline.expire(key, settings.RUN_CACHE_TTL)
+            pipeline.execute()
+
+    def main_geo_exists(self, campaign_id):
+        return self._server.hexists(self._main_geo_key(), str(campaign_id))
+
+    def campaigns_main_geos_exist(self, campaigns_ids):
+        """
+        Check, which campaigns have cached main geo, by one round-trip.
+
+        :param campaigns_ids: campaigns ids
+        :type campaigns_ids: List[int]
 
-    def exists(self, campaign_id):
-        campaign_id = str(campaign_id)
+        :return: flag for each campaign id
+        :rtype: Dict[int, bool]
+        """
 
-        return self._server.exists(campaign_id)
+        return {campaign_id: value is not None for campaign_id, value in
+                zip(campaigns_ids, self._hmget(self._main_geo_key(), campaigns_ids))}
 
     def get_campaign_main_geo(self, campaign_id):
-        campaign_id = str(campaign_id)
+        value = self._server.hget(self._main_geo_key(), str(campaign_id))
 
-        if self.exists(campaign_id):
-            return json.loads(self._server.get(campaign_id))['geo']
+        if value is not None:
+            return json.loads(value)['geo']
+
+    def get_campaigns_main_geos(self, campaigns_ids):
+        """
+        Get cached main geo for several campaigns by one round-trip.
+
+        :param campaigns_ids: campaigns ids
+        :type campaigns_ids: List[int]
+
+        :return: main geo for each campaign id, that has cached main geo
+        :rtype: Dict[int, Union[int, str, None]]
+        """
+
+        return {campaign_id: json.loads(value)['geo'] for campaign_id, value in
+                zip(campaigns_ids, self._hmget(self._main_geo_key(), campaigns_ids)) if value is not None}
 
     def get_campaign_offers(self, campaign_id):
-        campaign_id = str(campaign_id)
+        return self.get_campaigns_offers([campaign_id]).get(campaign_id)
+
+    def campaigns_offers_exist(self, campaigns_ids):
+        """
+        Check, which campaigns have cached routing, by one round-trip.
+
+        :param campaigns_ids: campaigns ids
+        :type campaigns_ids: List[int]
+
+        :return: flag for each campaign id
+        :rtype: Dict[int, bool]
+        """
+
+        with self._server.pipeline(transaction=False) as pipeline:
+            for campaign_id in campaigns_ids:
+                pipeline.exists(self._offers_key(campaign_id))
+
+            return {campaign_id: bool(offers_exist) for campaign_id, offers_exist in
+                    zip(campaigns_ids, pipeline.execute())}
+
+    def get_campaigns_offers(self, campaigns_ids):
+        """
+        Get cached routing for several campaigns (from in-process cache or from redis by one round-trip).
+
+        :param campaigns_ids: campaigns ids
+        :type campaigns_ids: List[int]
+
+        :return: offers ids for each campaign id, that has cached routing
+        :rtype: Dict[int, List[int]]
+        """
+
+        local_cache = _get_offers_local_cache()
+        result = local_cache.get_many(campaigns_ids)
+        campaigns_ids = [campaign_id for campaign_id in campaigns_ids if campaign_id not in result]
 
-        if self.exists(campaign_id):
-            return json.loads(self._server.get(campaign_id))['offers']
+        if not campaigns_ids:
+            return result
+
+        values = self._server.mget([self._offers_key(campaign_id) for campaign_id in campaigns_ids])
+        redis_result = {campaign_id: json.loads(value)['offers'] for campaign_id, value in
+                        zip(campaigns_ids, values) if value is not None}
+
+        local_cache.set_many(redis_result)
+        result.update(redis_result)
+
+        return result
 
     def add_campaign_offers(self, campaign_id, offers_list):
-        campaign_id = str(campaign_id)
+        self.add_campaigns_offers({campaign_id: offers_list})
+
+    def add_campaigns_offers(self, campaigns_offers):
+        """
+        Save routing for several campaigns by one round-trip. Routing, that is already cached in redis, is kept
+        (e.g. it was saved by other worker), and in-process cache gets the same routing, as redis holds.
+
+        :param campaigns_offers: offers ids for each campaign id
+        :type campaigns_offers: Dict[int, List[int]]
+        """
+
+        if not campaigns_offers:
+            return
+
+        with self._server.pipeline(transaction=False) as pipeline:
+            for campaign_id, offers_list in campaigns_offers.items():
+                key = self._offers_key(campaign_id)
+                pipeline.set(key, json.dumps({'offers': offers_list}), ex=settings.ROUTING_CACHE_TTL, nx=True)
+                pipeline.get(key)
+
+            # results of SET and GET commands are interleaved
+            values = pipeline.execute()[1::2]
+
+        _get_offers_local_cache().set_many({campaign_id: json.loads(value)['offers'] for campaign_id, value in
+                                            zip(campaigns_offers, values) if value is not None})
+
+    def invalidate_campaigns_offers(self, campaigns_ids):
+        """
+        Remove cached routing for campaigns, e.g. when campaign offers were changed.
+
+        :param campaigns_ids: campaigns ids
+        :type campaigns_ids: Iterable[int]
+        """
+
+        campaigns_ids = list(campaigns_ids)
+        _get_offers_local_cache().delete_many(campaigns_ids)
 
-        if not self.exists(campaign_id):
-            self._server.append(campaign_id, json.dumps({'offers': offers_list}))
+        if campaigns_ids:
+            self._server.delete(*[self._offers_key(campaign_id) for campaign_id in campaigns_ids])
+
+    def _job_progress_key(self, job_id):
+        return f'{settings.REDIS_KEY_PREFIX}:job:{job_id}:progress'
+
+    def set_job_progress(self, job_id, stage, progress):
+        """
+        Save current stage of background calculation job.
+
+        :param job_id: calculation job id
+        :type job_id: UUID
+
+        :param stage: stage description
+        :type stage: str
+
+        :param progress: progress in percents
+        :type progress: int
+        """
+
+        key = self._job_progress_key(job_id)
+
+        with self._server.pipeline() as pipeline:
+            pipeline.hset(key, mapping={'stage': stage, 'progress': progress})
+            pipeline.expire(key, settings.RUN_CACHE_TTL)
+            pipeline.execute()
+
+    def get_job_progress(self, job_id):
+        """
+        :return: current stage and progress in percents of background calculation job (None, if job isn't started)
+        :rtype: Tuple[Optional[str], int]
+        """
+
+        stage, progress = self._server.hmget(self._job_progress_key(job_id), ['stage', 'progress'])
+
+        return (stage.decode() if stage is not None else None), int(progress or 0)
+
+    def _basic_info_key(self, name):
+        return f'{settings.REDIS_KEY_PREFIX}:sync:basic_info:{name}'
+
+    def get_basic_info_synced_at(self):
+        """
+        :return: unix time of last successful users, offers and traffic sources syncing (None, if there was no syncing)
+        :rtype: Optional[float]
+        """
+
+        synced_at = self._server.get(self._basic_info_key('synced_at'))
+
+        return float(synced_at) if synced_at is not None else None
+
+    def set_basic_info_synced_at(self, synced_at):
+        """
+        :param synced_at: unix time of successful users, offers and traffic sources syncing
+        :type synced_at: float
+        """
+
+        self._server.set(self._basic_info_key('synced_at'), synced_at)
+
+    def reset_basic_info_synced_at(self):
+        """
+        Mark users, offers and traffic sources as stale (they are synced by next calculation).
+        """
+
+        self._server.delete(self._basic_info_key('synced_at'))
+
+    def basic_info_sync_lock(self):
+        """
+        :return: lock, that is held by process, that syncs users, offers and traffic sources
+            (it expires after settings.BASIC_INFO_SYNC_LOCK_TTL seconds)
+        :rtype: redis.lock.Lock
+        """
+
+        return self._server.lock(self._basic_info_key('lock'), timeout=settings.BASIC_INFO_SYNC_LOCK_TTL)
+
+    @staticmethod
+    def local_cache_stats():
+        """
+        :return: counters of in-process campaigns routing cache (hits, misses, evictions, etc.)
+        :rtype: Dict[str, int]
+        """
+
+        return _get_offers_local_cache().stats()
+
+    def _hmget(self, key, campaigns_ids):
+        if not campaigns_ids:
+            return []
+
+        return self._server.hmget(key, [str(campaign_id) for campaign_id in campaigns_ids])
 
     def clear(self):
-        self._server.flushdb()
+        """
+        Remove cached info of current calculation (campaigns routing is kept).
+        """
+
+        self._profits.clear()
+        self._server.delete(self._main_geo_key(), self._profit_key())
 
     def __del__(self):
-        self._server.flushdb()
-        self._server.close()
+        if hasattr(self, '_server') and self._owns_run:
+            # exceptions can't be raised from finalizer, run info expires anyway (settings.RUN_CACHE_TTL)
+            try:
+                self.clear()
+            except redis.RedisError as error:
+                _logger.error(f"Can't remove cached info of run {self.run_id}: {error}")
@@ -4,122 +4,125 @@ All rights reserved.
 Author: German Yakimov
 """
 
-from fctools_salary.domains.accounts.test import Test
-
-
-class TestSplitter:
-    def __init(self):
-        pass
-
-    def split(self, test):
-        test_offers = list(test.offers.all())
-        test_traffic_sources = list(test.traffic_sources.all())
-        test_geo = list(test.geo.all())
-
-        if not test.one_budget_for_all_offers and len(test_offers) > 1:
-            tests_by_offers = self.split_by_offers(test)
-            test.delete()
-
-            for test in tests_by_offers:
-                self.split(test)
-
-        elif not test.one_budget_for_all_traffic_sources and len(test_traffic_sources) > 1:
-            tests_by_ts = self.split_by_traffic_sources(test)
-            test.delete()
+from itertools import product
 
-            for test in tests_by_ts:
-                self.split(test)
+from django.db import connection, transaction
 
-        elif not test.one_budget_for_all_geo and len(test_geo) > 1:
-            self.split_by_geo(test)
-            test.delete()
-
-    @staticmethod
-    def split_by_offers(test):
-        result = []
-
-        test_offers = list(test.offers.all())
-        test_traffic_sources = list(test.traffic_sources.all())
-        test_geo = list(test.geo.all())
-
-        for offer in test_offers:
-            new_test = Test(budget=test.budget, user=test.user,
-                            one_budget_for_all_traffic_sources=test.one_budget_for_all_traffic_sources,
-                            traffic_group=test.traffic_group,
-                            balance=test.balance,
-                            one_budget_for_all_geo=test.one_budget_for_all_geo,
-                            adding_date=test.adding_date,
-                            lifetime=test.lifetime,
-                            archived=test.archived)
-            new_test.save()
+from fctools_salary.domains.accounts.test import Test
 
-            for ts in test_traffic_sources:
-                new_test.traffic_sources.add(ts)
+# relations, that test can be split by, with flags, that disable splitting
+_SPLIT_RELATIONS = (
+    ("offers", "one_budget_for_all_offers"),
+    ("traffic_sources", "one_budget_for_all_traffic_sources"),
+    ("geo", "one_budget_for_all_geo"),
+)
 
-            for geo in test_geo:
-                new_test.geo.add(geo)
 
-            new_test.offers.add(offer)
-            result.append(new_test)
+class TestSplitter:
+    """
+    Splits tests without one budget for all offers (traffic sources, geo) into tests for each offer
+    (traffic source, geo) with the same budget and balance. Full offers x traffic sources x geo expansion
+    is computed in memory and saved by one bulk query for tests and one bulk query for each relation.
+    """
 
-        return result
+    def split(self, test):
+        """
+        :param test: test to split
+        :type test: Test
+
+        :return: number of created tests
+        :rtype: int
+        """
+
+        return self.split_all([test])
+
+    def split_all(self, tests):
+        """
+        Split several tests in one transaction. Tests, that don't need splitting, are kept,
+        split tests are replaced by new ones.
+
+        :param tests: tests to split (relations may be prefetched)
+        :type tests: Iterable[Test]
+
+        :return: number of created tests
+        :rtype: int
+        """
+
+        new_tests = []
+        new_tests_related_ids = []
+        split_tests_ids = []
+
+        for test in tests:
+            expansion = self._expand(test)
+
+            if expansion is None:
+                continue
+
+            split_tests_ids.append(test.id)
+
+            for related_ids in expansion:
+                new_tests.append(
+                    Test(budget=test.budget, user_id=test.user_id, traffic_group=test.traffic_group,
+                         balance=test.balance, one_budget_for_all_offers=test.one_budget_for_all_offers,
+                         one_budget_for_all_traffic_sources=test.one_budget_for_all_traffic_sources,
+                         one_budget_for_all_geo=test.one_budget_for_all_geo, adding_date=test.adding_date,
+                         lifetime=test.lifetime, archived=test.archived)
+                )
+                new_tests_related_ids.append(related_ids)
+
+        if not new_tests:
+            return 0
+
+        with transaction.atomic():
+            if connection.features.can_return_rows_from_bulk_insert:
+                Test.objects.bulk_create(new_tests)
+            else:
+                # ids of created rows are needed for relations, but database doesn't return them from bulk insert
+                for new_test in new_tests:
+                    new_test.save()
+
+            for index, (relation, _) in enumerate(_SPLIT_RELATIONS):
+                field = Test._meta.get_field(relation)
+                through = field.remote_field.through
+                test_column = f"{field.m2m_field_name()}_id"
+                related_column = f"{field.m2m_reverse_field_name()}_id"
+
+                through.objects.bulk_create(
+                    [
+                        through(**{test_column: new_test.id, related_column: related_id})
+                        for new_test, related_ids in zip(new_tests, new_tests_related_ids)
+                        for related_id in related_ids[index]
+                    ]
+                )
+
+            Test.objects.filter(id__in=split_tests_ids).delete()
+
+        return len(new_tests)
 
     @staticmethod
-    def split_by_geo(test):
-        result = []
+    def _expand(test):
+        """
+        :param test: test
+        :type test: Test
 
-        test_offers = list(test.offers.all())
-        test_traffic_sources = list(test.traffic_sources.all())
-        test_geo = list(test.geo.all())
+        :return: related ids (offers, traffic sources, geo) for each test, that test is split into,
+            None if test doesn't need splitting
+        :rtype: Optional[List[Tuple[List[int], List[int], List[int]]]]
+        """
 
-        for geo in test_geo:
-            new_test = Test(budget=test.budget, user=test.user,
-                            one_budget_for_all_traffic_sources=test.one_budget_for_all_traffic_sources,
-                            traffic_group=test.traffic_group,
-                            balance=test.balance,
-                            one_budget_for_all_offers=test.one_budget_for_all_offers,
-                            adding_date=test.adding_date,
-                            lifetime=test.lifetime,
-                            archived=test.archived)
-            new_test.save()
+        variants = []
+        split = False
 
-            for ts in test_traffic_sources:
-                new_test.traffic_sources.add(ts)
+        for relation, one_budget_flag in _SPLIT_RELATIONS:
+            related_ids = [related.pk for related in getattr(test, relation).all()]
 
-            for offer in test_offers:
-                new_test.offers.add(offer)
+            if not getattr(test, one_budget_flag) and len(related_ids) > 1:
+                variants.append([[related_id] for related_id in related_ids])
+                split = True
+            else:
+                variants.append([related_ids])
 
-            new_test.geo.add(geo)
-            result.append(new_test)
+        if not split:
+            return None
 
-        return result
-
-    @staticmethod
-    def split_by_traffic_sources(test):
-        result = []
-
-        test_offers = list(test.offers.all())
-        test_traffic_sources = list(test.traffic_sources.all())
-        test_geo = list(test.geo.all())
-
-        for ts in test_traffic_sources:
-            new_test = Test(budget=test.budget, user=test.user,
-                            one_budget_for_all_geo=test.one_budget_for_all_geo,
-                            traffic_group=test.traffic_group,
-                            balance=test.balance,
-                            one_budget_for_all_offers=test.one_budget_for_all_offers,
-                            adding_date=test.adding_date,
-                            lifetime=test.lifetime,
-                            archived=test.archived)
-            new_test.save()
-
-            for geo in test_geo:
-                new_test.geo.add(geo)
-
-            for offer in test_offers:
-                new_test.offers.add(offer)
-
-            new_test.traffic_sources.add(ts)
-            result.append(new_test)
-
-        return result
+        return list(product(*variants))
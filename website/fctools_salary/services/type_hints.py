@@ -6,8 +6,6 @@
 # Proprietary and confidential
 # Author: German Yakimov <german13yakimov@gmail.com>
 
-from typing import List, Dict, Union
+from fctools_salary.services.helpers.campaign_record import CampaignRecord
 
-from fctools_salary.domains.tracker.campaign import Campaign
-
-CampaignTracker = Dict[str, Union[Campaign, List]]
+CampaignTracker = CampaignRecord
@@ -0,0 +1,64 @@
+# Copyright © 2020-2021 Filthy Claws Tools - All Rights Reserved
+#
+# This file is part of FCTools_payroll
+#
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Author: German Yakimov <german13yakimov@gmail.com>
+
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, pre_save
+from django.dispatch import receiver
+from redis.exceptions import RedisError
+
+from fctools_salary.domains.accounts.user import User
+from fctools_salary.domains.tracker.campaign import Campaign
+from fctools_salary.services.helpers.redis_client import RedisClient, invalidate_campaigns_offers_on_commit
+
+_logger = logging.getLogger(__name__)
+
+
+@receiver(m2m_changed, sender=Campaign.offers_list.through)
+def campaign_offers_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Campaign routing (offers list) was changed, so cached routing isn't valid anymore.
+    Links inserted by bulk queries don't send this signal, such code invalidates routing itself
+    (see invalidate_campaigns_offers_on_commit).
+    """
+
+    if not reverse and action in ("post_add", "post_remove", "post_clear"):
+        invalidate_campaigns_offers_on_commit([instance.id])
+    elif reverse and action in ("post_add", "post_remove"):
+        invalidate_campaigns_offers_on_commit(pk_set)
+    elif reverse and action == "pre_clear":
+        invalidate_campaigns_offers_on_commit(instance.campaigns_list.values_list("id", flat=True))
+
+
+@receiver(post_delete, sender=Campaign)
+def campaign_deleted(sender, instance, **kwargs):
+    invalidate_campaigns_offers_on_commit([instance.id])
+
+
+@receiver(pre_save, sender=User)
+def user_activating(sender, instance, raw, **kwargs):
+    """
+    Traffic sources of inactive users aren't synced (settings.TRAFFIC_SOURCES_OWNERS is "active"),
+    so synced info becomes stale, when user becomes active.
+    """
+
+    if raw or settings.TRAFFIC_SOURCES_OWNERS != "active" or not instance.salary_group or instance.salary_group < 0:
+        return
+
+    if User.objects.filter(id=instance.id, salary_group__gt=0).exists():
+        return
+
+    def reset():
+        try:
+            RedisClient().reset_basic_info_synced_at()
+        except RedisError as error:
+            _logger.error(f"Can't mark synced info as stale after user {instance.id} activation: {error}")
+
+    transaction.on_commit(reset)
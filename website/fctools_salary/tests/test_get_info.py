@@ -0,0 +1,139 @@
+# Copyright © 2020-2021 Filthy Claws Tools - All Rights Reserved
+#
+# This file is part of FCTools_payroll
+#
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Author: German Yakimov <german13yakimov@gmail.com>
+
+import json
+import threading
+import time
+from collections import Counter
+from datetime import date
+from types import SimpleNamespace
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+import requests
+from django.test import SimpleTestCase, override_settings
+
+from fctools_salary.services.binom.get_info import get_campaigns_main_geos
+from fctools_salary.services.engine.tests_manager import TestsManager
+
+
+class _StatsClient:
+    """
+    Tracker client stub: answers Stats requests with campaign geo clicks and records concurrency of requests.
+    """
+
+    def __init__(self, delay=0.02):
+        self.delay = delay
+        self.requests = Counter()
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def get(self, endpoint, url, params=None):
+        campaign_id = int(parse_qs(urlparse(url).query)["camp_id"][0])
+
+        with self._lock:
+            self.requests[campaign_id] += 1
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+
+        time.sleep(self.delay)
+
+        with self._lock:
+            self.active -= 1
+
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps([{"name": "Russia", "clicks": str(campaign_id)},
+                                        {"name": "Germany", "clicks": "10"}]).encode()
+
+        return response
+
+
+class _RedisStub:
+    def __init__(self):
+        self.main_geos = {}
+
+    def get_campaigns_main_geos(self, campaigns_ids):
+        return {campaign_id: self.main_geos[campaign_id] for campaign_id in campaigns_ids
+                if campaign_id in self.main_geos}
+
+    def add_campaigns_main_geos(self, main_geos):
+        for campaign_id, main_geo in main_geos.items():
+            self.main_geos.setdefault(campaign_id, main_geo)
+
+
+class _IndexStub:
+    def __init__(self, indexes):
+        self.indexes = indexes
+
+    def match(self, traffic_sources_ids, offers_ids):
+        return self.indexes
+
+
+@override_settings(BINOM_CONCURRENCY=3)
+class CampaignsMainGeosTest(SimpleTestCase):
+    """
+    Tracker statistics page is requested for each campaign, so number of parallel requests has to be bounded
+    and campaigns mustn't be requested twice.
+    """
+
+    start_date = date(2021, 1, 1)
+    end_date = date(2021, 1, 15)
+
+    def setUp(self):
+        self.client = _StatsClient()
+        patcher = mock.patch("fctools_salary.services.binom.get_info.get_client", return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_requests_are_bounded_by_concurrency(self):
+        campaigns = [SimpleNamespace(id=campaign_id) for campaign_id in range(1, 21)]
+
+        main_geos = get_campaigns_main_geos(campaigns + campaigns[:5], self.start_date, self.end_date)
+
+        self.assertEqual(main_geos, {campaign_id: "Russia" if campaign_id >= 10 else "Germany"
+                                     for campaign_id in range(1, 21)})
+        self.assertEqual(self.client.requests, Counter(range(1, 21)))
+        self.assertLessEqual(self.client.max_active, 3)
+
+    def test_in_flight_requests_are_shared(self):
+        campaigns = [SimpleNamespace(id=campaign_id) for campaign_id in range(1, 7)]
+        self.client.delay = 0.2
+        barrier = threading.Barrier(2)
+        results = [None, None]
+
+        def get_main_geos(index):
+            barrier.wait()
+            results[index] = get_campaigns_main_geos(campaigns, self.start_date, self.end_date, max_workers=6)
+
+        threads = [threading.Thread(target=get_main_geos, args=(index,)) for index in range(2)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(self.client.requests, Counter(range(1, 7)))
+
+    def test_cached_main_geos_are_not_requested(self):
+        campaigns = [SimpleNamespace(id=campaign_id) for campaign_id in range(1, 6)]
+        tests_info = [(None, set(), [], ["Russia"])]
+        redis = _RedisStub()
+        redis.main_geos[1] = "Spain"
+
+        first = TestsManager._get_main_geos(tests_info, campaigns, _IndexStub(range(5)), self.start_date,
+                                            self.end_date, redis)
+        second = TestsManager._get_main_geos(tests_info, campaigns, _IndexStub(range(5)), self.start_date,
+                                             self.end_date, redis)
+
+        self.assertEqual(first, second)
+        self.assertEqual(first[1], "Spain")
+        self.assertEqual(self.client.requests, Counter(range(2, 6)))
@@ -0,0 +1,53 @@
+# Copyright © 2020-2021 Filthy Claws Tools - All Rights Reserved
+#
+# This file is part of FCTools_payroll
+#
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Author: German Yakimov <german13yakimov@gmail.com>
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+from django.conf import settings
+from django.db import connections
+from django.test import TransactionTestCase, override_settings
+
+from fctools_salary.domains.accounts.user import User
+from fctools_salary.services.engine.payroll import _calculate_users_in_processes
+from fctools_salary.services.engine.payroll_worker import init_worker
+
+
+def _get_user_login(user_id):
+    return User.objects.get(id=user_id).login
+
+
+@override_settings(PAYROLL_START_METHOD="spawn")
+class SpawnedPayrollWorkersTest(TransactionTestCase):
+    """
+    Spawned worker process imports payroll modules from scratch, so they must be importable before Django is set up.
+    """
+
+    def test_spawned_worker_uses_parent_database(self):
+        user = User.objects.create(id=1, login="worker", salary_group=1)
+        databases_names = {alias: connections[alias].settings_dict["NAME"] for alias in connections}
+
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=init_worker,
+                                 initargs=(settings.SETTINGS_MODULE, databases_names)) as executor:
+            self.assertEqual(executor.submit(_get_user_login, user.id).result(timeout=60), "worker")
+
+    def test_payroll_runs_in_spawned_workers(self):
+        # users are absent in database, so workers fail before any request to tracker
+        users = [User(id=1001, login="first"), User(id=1002, login="second")]
+
+        results = _calculate_users_in_processes(users, date(2021, 2, 1), date(2021, 2, 15), False,
+                                                [settings.PUSH_TRAFF], 2, "test-run")
+
+        self.assertEqual(set(results), {1001, 1002})
+
+        for result in results.values():
+            self.assertIsNone(result["result"])
+            self.assertIn("DoesNotExist", result["error"])
+            self.assertNotIn("BrokenProcessPool", result["error"])
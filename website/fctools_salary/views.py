@@ -14,10 +14,11 @@ import traceback
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.views import LogoutView as DJLogoutView
 from django.db import transaction
-from django.shortcuts import render
+from django.http import JsonResponse
+from django.shortcuts import render, redirect, get_object_or_404
 
-from fctools_salary.services.binom.update import update_basic_info
-from fctools_salary.services.engine.engine import calculate_user_salary
+from fctools_salary.domains.accounts.calculation_job import CalculationJob
+from fctools_salary.services.engine.calculation_jobs import enqueue_calculation, get_job_status, get_job_result
 from .forms import CalculationForm
 
 _logger = logging.getLogger(__name__)
@@ -98,11 +99,10 @@ def count_view(request):
     View with form for calculation configuration.
 
     :param request: request
-    :return: if form is valid, calculate salary and returns result page (count_result.html)
+    :return: if form is valid, starts calculation in background and redirects to its status page
     """
 
     form_template = os.path.join("fctools_salary", "count.html")
-    result_template = os.path.join("fctools_salary", "count_result.html")
 
     if request.method == "POST":
         form = CalculationForm(request.POST)
@@ -114,13 +114,9 @@ def count_view(request):
             update_db_flag = form.cleaned_data["update_db"]
             traffic_groups = form.cleaned_data["traffic_groups"]
 
-            update_basic_info()
+            job = enqueue_calculation(user, start_date, end_date, update_db_flag, traffic_groups)
 
-            return render(
-                request,
-                result_template,
-                context=calculate_user_salary(user, start_date, end_date, update_db_flag, traffic_groups),
-            )
+            return redirect("count_status", job_id=job.id)
         else:
             _logger.warning("Incorrect report form.")
             return render(request, form_template, {"form": form})
@@ -130,5 +126,40 @@ def count_view(request):
         return render(request, form_template, {"form": form})
 
 
+@base_view
+@login_required(login_url="/login/")
+def count_status_view(request, job_id):
+    """
+    Status of background calculation. With "format=json" GET-parameter returns job status and progress
+    (for polling).
+
+    :param request: request
+    :param job_id: calculation job id
+    :return: result page (count_result.html, payroll_result.html for payroll), if calculation is done,
+        error page, if it failed,
+        else page with calculation progress (count_status.html)
+    """
+
+    status_template = os.path.join("fctools_salary", "count_status.html")
+    result_template = os.path.join("fctools_salary", "count_result.html")
+
+    job = get_object_or_404(CalculationJob, id=job_id)
+    status = get_job_status(job)
+
+    if request.GET.get("format") == "json":
+        return JsonResponse(status)
+
+    if job.status == CalculationJob.DONE:
+        if job.is_payroll:
+            result_template = os.path.join("fctools_salary", "payroll_result.html")
+
+        return render(request, result_template, context=get_job_result(job))
+
+    if job.status == CalculationJob.FAILED:
+        return _return(request, job.error, job.traceback, status_code=500)
+
+    return render(request, status_template, context={"job": job, "status": status})
+
+
 class LogoutView(DJLogoutView):
     next_page = "login"
@@ -119,6 +119,67 @@ TRAFFIC_GROUPS = (
 
 REDIS_HOST = 'localhost'
 REDIS_PORT = '6214'
+REDIS_MAX_CONNECTIONS = 50
+REDIS_KEY_PREFIX = 'fctools_salary'
+
+# campaigns routing (offers ids) cache lifetime in seconds
+ROUTING_CACHE_TTL = 60 * 60 * 24
+
+# deltas from previous periods: only reports, that ended not earlier than DELTAS_LOOKBACK_DAYS days ago, are checked
+# (None - all reports), report is settled (not checked anymore) after DELTAS_SETTLE_CHECKS checks without changes,
+# if its period ended at least DELTAS_SETTLE_MIN_AGE_DAYS days ago (tracker conversions window)
+DELTAS_LOOKBACK_DAYS = None
+DELTAS_SETTLE_CHECKS = 3
+DELTAS_SETTLE_MIN_AGE_DAYS = 30
+
+# how campaigns for previous periods are fetched: "periods" - one request (see CAMPAIGNS_SOURCE) for each period,
+# "days" - daily statistics of all periods are loaded from local table by one query and summed for each period
+# (calculation fails, if some day isn't synced, see update_daily_stats command)
+DELTAS_FETCH_MODE = "periods"
+
+# campaigns statistics source for calculations: "tracker" or "local" (daily statistics table, tracker is used,
+# if table doesn't cover the period); local table keeps DAILY_STATS_INITIAL_DAYS days of history
+# and its last DAILY_STATS_REFRESH_DAYS days are updated again on each sync (late conversions)
+CAMPAIGNS_SOURCE = "tracker"
+DAILY_STATS_INITIAL_DAYS = 180
+DAILY_STATS_REFRESH_DAYS = 7
+
+# users, offers and traffic sources syncing: delete rows, that were removed from tracker
+# (deletion cascades to dependent rows, e.g. campaigns of removed traffic sources)
+SYNC_DELETE_MISSING = False
+
+# owners of traffic sources, that are requested from tracker on syncing: "active" - users with salary group
+# (traffic sources of inactive users aren't updated, user activation makes synced info stale), "all" - all users
+TRAFFIC_SOURCES_OWNERS = "active"
+
+# users, offers and traffic sources are synced again, if last syncing was more than BASIC_INFO_MAX_AGE seconds ago
+# (admin pages start syncing in background, calculations wait for it); syncing is done by one process at once,
+# its lock expires after BASIC_INFO_SYNC_LOCK_TTL seconds; BASIC_INFO_SYNC_INTERVAL is default interval
+# in seconds of periodic syncing (sync_basic_info command with --loop)
+BASIC_INFO_MAX_AGE = 60 * 15
+BASIC_INFO_SYNC_LOCK_TTL = 60 * 5
+BASIC_INFO_SYNC_INTERVAL = 60 * 10
+
+# batch payroll run: number of worker processes (1 - calculate users in current process)
+# and start method for them ("fork" or "spawn")
+PAYROLL_WORKERS = 1
+PAYROLL_START_METHOD = "fork"
+
+# number of threads, that execute calculations requested from /count page
+CALCULATION_WORKERS = 2
+
+# process, that runs calculations, marks them as alive every CALCULATION_HEARTBEAT_INTERVAL seconds,
+# running calculation without heartbeat for CALCULATION_HEARTBEAT_TIMEOUT seconds is marked as failed
+# (process was stopped or restarted)
+CALCULATION_HEARTBEAT_INTERVAL = 30
+CALCULATION_HEARTBEAT_TIMEOUT = 60 * 5
+
+# in-process campaigns routing cache (before redis): max entries number and entries lifetime in seconds
+LOCAL_CACHE_MAX_SIZE = 50000
+LOCAL_CACHE_TTL = 60 * 5
+
+# lifetime in seconds of cached info of one calculation (removed after calculation, if it ends normally)
+RUN_CACHE_TTL = 60 * 60
 
 # settings for pdf reports generating
 TABLE_STYLE = TableStyle([("GRID", (0, 0), (-1, -1), 2, colors.black), ("ALIGN", (0, 0), (-1, -1), "CENTER"),
@@ -131,6 +192,26 @@ PARAGRAPH_STYLE_FONT_12 = ParagraphStyle(name="style", alignment=1, fontSize=12,
 BINOM_API_KEY = os.getenv("BINOM_API_KEY")
 TRACKER_URL = "https://fcttrk.com/"
 
+# tracker http client settings
+BINOM_POOL_SIZE = 20
+BINOM_MAX_RETRIES = 3
+BINOM_BACKOFF_FACTOR = 0.5
+BINOM_BACKOFF_MAX = 10
+
+# max number of parallel requests to tracker (1 - serial requests)
+BINOM_CONCURRENCY = 8
+
+# (connect timeout, read timeout) in seconds for each tracker endpoint
+BINOM_TIMEOUTS = {
+    "default": (5, 60),
+    "Users": (5, 30),
+    "Offers": (5, 60),
+    "Traffic_Sources": (5, 30),
+    "Campaigns": (5, 120),
+    "campaign@get_full": (5, 30),
+    "Stats": (5, 60),
+}
+
 DATABASE_USER = os.getenv("DATABASE_USER")
 DATABASE_PASSWORD = os.getenv("DATABASE_PASSWORD")
 
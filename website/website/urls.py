@@ -12,12 +12,13 @@ from django.contrib import admin
 from django.contrib.auth import views
 from django.urls import path, include
 
-from fctools_salary.views import base_menu, count_view, LogoutView
+from fctools_salary.views import base_menu, count_view, count_status_view, LogoutView
 
 urlpatterns = static(settings.STATIC_URL, document_root=settings.STATIC_ROOT) + \
               static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT) + [
                   path("", base_menu, name="base_menu"),
                   path("count/", count_view, name="count"),
+                  path("count/<uuid:job_id>/", count_status_view, name="count_status"),
                   path("logout/", LogoutView.as_view(), name="logout"),
                   path("admin/", admin.site.urls),
                   path("login/", views.LoginView.as_view(), name="login"),